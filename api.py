@@ -1,56 +1,64 @@
 import os
+import io
+import hmac
 import json
 import boto3
-from flask import Flask, request, jsonify, make_response, send_file, render_template, Response, send_from_directory
+from flask import Flask, Request, request, jsonify, make_response, send_file, render_template, Response, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from s3_transfer import get_s3_client, presigned_url, upload_stream
+from job_store import FAILED, PUBLIC_COLUMNS, JobStore, content_key
+from sendmail import send_secure_email
+from threading import Thread
 import uuid
 
 # Load environment variables
 load_dotenv()
 
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+# Required in X-Admin-Token by GET /jobs; the listing is off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+class InMemoryUploadRequest(Request):
+    # Keep uploaded files in memory instead of spooling them to a temporary
+    # file; MAX_CONTENT_LENGTH bounds the size
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 # Flask app setup
 app = Flask(__name__,  static_url_path='/static', static_folder='static')
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
 CORS(app)  # Enable CORS for all routes
 
-# Directory where files are saved
-UPLOAD_FOLDER = os.path.join(app.root_path, 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
 # AWS configuration
 AWS_REGION = os.getenv("AWS_REGION")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 SQS_QUEUE_URL = os.getenv("SQS_QUEUE_URL")
-s3 = boto3.client('s3', region_name=AWS_REGION)
+EMAIL = os.getenv("EMAIL")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+s3 = get_s3_client()
 sqs = boto3.client('sqs', region_name=AWS_REGION)
 
+# Uploads are keyed by content so the same book is only translated once
+job_store = JobStore()
+
 # Allowed extensions
 ALLOWED_EXTENSIONS = {'txt'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def upload_file_to_s3(file_path, bucket_name, object_name):
+def upload_file_to_s3(fileobj, bucket_name, object_name):
     try:
-        print(file_path)
-        s3.upload_file(file_path, bucket_name, object_name)
+        print(object_name)
+        upload_stream(fileobj, bucket_name, object_name)
         return True
     except Exception as e:
         print(f"Error uploading file to S3: {e}")
         return False
 
-# def upload_file_to_s3(file_path, bucket_name, object_name):
-#     try:
-#         print(file_path)
-#         with open(file_path, 'rb') as file:
-#             s3.upload_fileobj(file, bucket_name, object_name)
-#         return True
-#     except Exception as e:
-#         print(f"Error uploading file to S3: {e}")
-#         return False
-
 
 @app.route('/')
 def serve_index():
@@ -69,36 +77,97 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        
+        source_lang = request.form.get('source_lang', 'en')
+        target_lang = request.form.get('target_lang', 'vi')
+        recipient_email = request.form.get('recipient_email', '')
+        # Uploads can only ask for a lower priority; "high" is set by operators
+        priority = 'bulk' if request.form.get('priority') == 'bulk' else 'normal'
+        book_key = content_key(file.stream, source_lang, target_lang)
+        file.stream.seek(0)
+
+        # The same book was translated before: hand out the existing result
+        done = job_store.find_done(book_key)
+        if done is not None:
+            try:
+                s3.head_object(Bucket=done['s3_bucket'], Key=done['result_key'])
+            except Exception:
+                # The result has expired from the bucket; translate again
+                done = None
+        if done is not None:
+            download_url = presigned_url(done['s3_bucket'], done['result_key'])
+            if recipient_email:
+                email_body = f"Your processed book is ready. You can download it from: {download_url} within 7 days"
+                Thread(target=send_secure_email, args=("Your book is ready!", email_body, recipient_email, EMAIL, EMAIL_PASSWORD), daemon=True).start()
+            return jsonify({"message": "Translation already available", "unique_id": done['unique_id'], "download_url": download_url}), 200
+
         # Generate a unique ID for this file
         unique_id = str(uuid.uuid4())
         s3_object_key = f"{filename.rsplit('.', 1)[0]}_{unique_id}.{filename.rsplit('.', 1)[1]}"
-        
-        # Upload the file to S3
-        if upload_file_to_s3(filepath, S3_BUCKET_NAME, s3_object_key):
+
+        # The same book is queued or running: wait for that job instead
+        unique_id, created = job_store.create_or_attach(unique_id, book_key, S3_BUCKET_NAME, s3_object_key, source_lang, target_lang, recipient_email, priority)
+        if not created:
+            return jsonify({"message": "Translation already in progress", "unique_id": unique_id}), 200
+
+        # Upload the file to S3 straight from the request's buffer
+        if upload_file_to_s3(file.stream, S3_BUCKET_NAME, s3_object_key):
             # Send a message to SQS with the S3 object reference
             message = {
                 's3_bucket': S3_BUCKET_NAME,
                 's3_key': s3_object_key,
                 'unique_id': unique_id,
-                'source_lang': request.form.get('source_lang', 'en'),
-                'target_lang': request.form.get('target_lang', 'vi'),
-                'recipient_email': request.form.get('recipient_email', '')
+                'source_lang': source_lang,
+                'target_lang': target_lang,
+                'recipient_email': recipient_email,
+                'priority': priority
             }
-            
-            sqs.send_message(
-                QueueUrl=SQS_QUEUE_URL,
-                MessageBody=json.dumps(message)
-            )
-            
-            return jsonify({"message": "File uploaded successfully and message sent to queue"}), 200
+
+            try:
+                sqs.send_message(
+                    QueueUrl=SQS_QUEUE_URL,
+                    MessageBody=json.dumps(message)
+                )
+            except Exception as e:
+                job_store.set_state(unique_id, FAILED)
+                return jsonify({"error": f"Failed to queue translation: {e}"}), 500
+
+            return jsonify({"message": "File uploaded successfully and message sent to queue", "unique_id": unique_id}), 200
         else:
+            # Free the book so the next upload can try again
+            job_store.set_state(unique_id, FAILED)
             return jsonify({"error": "Failed to upload file to S3"}), 500
 
     return jsonify({"error": "File type not allowed"}), 400
 
+def public_job(job):
+    return {column: job.get(column) for column in PUBLIC_COLUMNS}
+
+@app.route("/jobs/<unique_id>", methods=["GET"])
+def get_job(unique_id):
+    job = job_store.get(unique_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job(job)), 200
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    # Every job of every user; a single job is looked up by its unguessable id above
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    jobs = job_store.list_jobs(
+        state=request.args.get('state'),
+        limit=limit,
+        offset=offset,
+    )
+    return jsonify({"counts": job_store.counts(), "jobs": [public_job(job) for job in jobs]}), 200
+
 @app.route("/supported_langs", methods=["GET"])
 def fetch_supported_langs():
     try:
@@ -0,0 +1,215 @@
+"""
+Asyncio serving path for the translation API.
+
+/translate requests go into a bounded queue and are served by a fixed number
+of inference slots. When the queue is full the server answers 429 with a
+Retry-After header, and a request whose deadline passes while it waits is
+dropped before it reaches the model. Every other route is served by the
+Flask app in main.py.
+
+* Run:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import os
+import json
+import time
+import queue
+import asyncio
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import main
+from metrics import QUEUE_DEPTH, REGISTRY
+
+ASYNC_QUEUE_SIZE = int(os.getenv("ASYNC_QUEUE_SIZE", "256"))
+# Inference calls in flight; keep it at least BATCH_MAX_SIZE so batches can fill
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", "32"))
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+RETRY_AFTER_SECONDS = os.getenv("RETRY_AFTER_SECONDS", "1")
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TranslateQueue:
+    """Bounded queue of translation requests served by `workers` inference slots."""
+
+    def __init__(self, translate, max_size=ASYNC_QUEUE_SIZE, workers=ASYNC_WORKERS):
+        self.translate = translate
+        self.max_size = max_size
+        self.workers = workers
+        self.dropped = 0
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _start(self):
+        # Created on first use so the queue belongs to the server's event loop
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        for _ in range(self.workers):
+            asyncio.get_running_loop().create_task(self._worker())
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, text, source_lang, target_lang, deadline):
+        """Queue a request and wait for its translation.
+
+        Raises asyncio.QueueFull when the queue is full and DeadlineExceeded
+        when the deadline (time.monotonic() based) passes first.
+        """
+        if self._queue is None:
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, source_lang, target_lang, deadline, future))
+        try:
+            return await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            text, source_lang, target_lang, deadline, future = await self._queue.get()
+            if future.done():
+                # The request already gave up waiting
+                self.dropped += 1
+                continue
+            if time.monotonic() >= deadline:
+                # Nobody is waiting for it any more; do not spend the model on it
+                self.dropped += 1
+                future.set_exception(DeadlineExceeded("Deadline exceeded"))
+                continue
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, self.translate, text, source_lang, target_lang
+                )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+
+translate_queue = TranslateQueue(main.translate_with_timing)
+QUEUE_DEPTH.set_function(translate_queue.depth, queue="asgi")
+REGISTRY.gauge(
+    "translation_deadline_dropped", "Queued requests dropped after their deadline"
+).set_function(lambda: translate_queue.dropped)
+flask_app = WsgiToAsgi(main.app)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"access-control-allow-origin", b"*"),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def translate(scope, receive, send):
+    if scope["method"] == "GET":
+        args = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+        original_text = args.get("text", "Please input some text")
+        data = args
+    else:
+        try:
+            data = json.loads(await read_body(receive) or b"{}")
+        except ValueError:
+            await send_json(send, 400, {"error": "Invalid JSON body"})
+            return
+        if not isinstance(data, dict):
+            await send_json(send, 400, {"error": "JSON body must be an object"})
+            return
+        original_text = data.get("text", "")
+    source_lang = data.get("source_lang", "en")
+    target_lang = data.get("target_lang", "vi")
+    try:
+        main.check_langs(source_lang, target_lang)
+    except main.UnsupportedLanguage as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+
+    headers = dict(scope.get("headers", []))
+    # 0 is a deadline, not "unset"
+    deadline_ms = headers.get(b"x-request-deadline-ms")
+    if deadline_ms is not None:
+        deadline_ms = deadline_ms.decode()
+    else:
+        deadline_ms = data.get("deadline_ms")
+    if deadline_ms is None:
+        deadline_ms = REQUEST_DEADLINE_MS
+    try:
+        deadline_ms = float(deadline_ms)
+    except (TypeError, ValueError):
+        await send_json(send, 400, {"error": "Invalid deadline"})
+        return
+    deadline = time.monotonic() + deadline_ms / 1000.0
+
+    retry_after = [(b"retry-after", RETRY_AFTER_SECONDS.encode())]
+    try:
+        translated_text = await translate_queue.submit(
+            original_text, source_lang, target_lang, deadline
+        )
+    except (asyncio.QueueFull, queue.Full):
+        await send_json(send, 429, {"error": "Too many pending translation requests"}, retry_after)
+        return
+    except DeadlineExceeded as e:
+        await send_json(send, 504, {"error": str(e)})
+        return
+    except Exception as e:
+        await send_json(send, 500, {"error": str(e)})
+        return
+
+    await send_json(
+        send,
+        200,
+        {
+            "original_text": original_text,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "translated_text": translated_text,
+        },
+    )
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] == "/translate" and scope["method"] in ("GET", "POST"):
+        await translate(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    else:
+        await flask_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("ASYNC_PORT", "5000")))
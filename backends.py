@@ -0,0 +1,243 @@
+import os
+import re
+import time
+import threading
+from types import SimpleNamespace
+
+from metrics import STAGE_SECONDS, observe_generate
+
+# cuda, cpu or fake; CPU_DIRECTIONS moves selected directions onto the CPU
+TRANSLATION_BACKEND = os.getenv("TRANSLATION_BACKEND", "cuda")
+CPU_DIRECTIONS = [d.strip() for d in os.getenv("CPU_DIRECTIONS", "").split(",") if d.strip()]
+CUDA_COMPUTE_TYPE = os.getenv("CUDA_COMPUTE_TYPE", "int8_float16")
+CPU_COMPUTE_TYPE = os.getenv("CPU_COMPUTE_TYPE", "int8")
+CT2_INTER_THREADS = int(os.getenv("CT2_INTER_THREADS", "1"))
+CT2_INTRA_THREADS = int(os.getenv("CT2_INTRA_THREADS", "0"))
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "20"))
+FAKE_LATENCY_PER_TOKEN_MS = float(os.getenv("FAKE_LATENCY_PER_TOKEN_MS", "0.05"))
+
+
+class TranslationBackend:
+    """A translation model plus its tokenizer.
+
+    `model` follows the ctranslate2.Translator `translate_batch` interface and
+    `tokenizer` the Hugging Face tokenizer interface, so the helpers in
+    token_batches.py and pivot.py work with every backend.
+    """
+
+    def __init__(self, model, tokenizer, model_id, capabilities):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_id = model_id
+        self.capabilities = capabilities
+        # Metrics label; load_backend sets it to the direction the model serves
+        self.direction = model_id
+        # M2M100-style tokenizers keep the source language as state
+        self._src_lang_lock = threading.Lock()
+
+    def tokenize(self, texts):
+        """Token ids of each text without special tokens."""
+        return self.tokenizer(texts, add_special_tokens=False).input_ids
+
+    def generate(self, text, src_lang=None, tgt_lang=None):
+        """Translate a string or a list of strings.
+
+        Multilingual models take one source and target language per text.
+        """
+        single = isinstance(text, str)
+        texts = [text] if single else list(text)
+        start_time = time.perf_counter()
+        if src_lang is None:
+            source = [
+                self.tokenizer.convert_ids_to_tokens(ids)
+                for ids in self.tokenizer(texts).input_ids
+            ]
+            target_prefix = None
+        else:
+            source = []
+            with self._src_lang_lock:
+                for t, src in zip(texts, src_lang):
+                    self.tokenizer.src_lang = src
+                    source.append(
+                        self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(t))
+                    )
+            target_prefix = [[self.tokenizer.get_lang_token(tgt)] for tgt in tgt_lang]
+        tokenized_time = time.perf_counter()
+        STAGE_SECONDS.observe(tokenized_time - start_time, direction=self.direction, stage="tokenize")
+
+        results = self.model.translate_batch(source, target_prefix=target_prefix)
+        # Multilingual output starts with the target language token; drop it
+        skip = 0 if target_prefix is None else 1
+        hypotheses = [result.hypotheses[0][skip:] for result in results]
+        generated_time = time.perf_counter()
+        observe_generate(
+            self.direction,
+            len(texts),
+            sum(len(tokens) for tokens in source),
+            sum(len(tokens) for tokens in hypotheses),
+            generated_time - tokenized_time,
+        )
+
+        translated = [
+            self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True
+            )
+            for tokens in hypotheses
+        ]
+        STAGE_SECONDS.observe(time.perf_counter() - generated_time, direction=self.direction, stage="detokenize")
+        return translated[0] if single else translated
+
+
+def load_ct2_backend(model_path, tokenizer_name, device, multilingual=False):
+    import ctranslate2
+    from transformers import AutoTokenizer
+
+    if not os.path.isdir(model_path):
+        # A Hugging Face repo id such as "michaelfeil/ct2fast-m2m100_1.2B"
+        from huggingface_hub import snapshot_download
+
+        model_path = snapshot_download(model_path)
+
+    if device == "cuda":
+        compute_type = CUDA_COMPUTE_TYPE
+        model = ctranslate2.Translator(model_path, device="cuda", compute_type=compute_type)
+        capabilities = {"device": "cuda", "compute_type": compute_type}
+    else:
+        compute_type = CPU_COMPUTE_TYPE
+        model = ctranslate2.Translator(
+            model_path,
+            device="cpu",
+            compute_type=compute_type,
+            inter_threads=CT2_INTER_THREADS,
+            intra_threads=CT2_INTRA_THREADS,
+        )
+        capabilities = {
+            "device": "cpu",
+            "compute_type": compute_type,
+            "inter_threads": CT2_INTER_THREADS,
+            "intra_threads": CT2_INTRA_THREADS,
+        }
+    capabilities.update({"multilingual": multilingual, "token_ids": True})
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name or model_path)
+    return TranslationBackend(model, tokenizer, os.path.basename(model_path.rstrip("/")), capabilities)
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer covering the tokenizer calls the service makes.
+
+    A token's id is its UTF-8 bytes read as an integer, so ids are stable
+    across processes and decode without a vocabulary table that would grow
+    with every new word.
+    """
+
+    eos_token = "</s>"
+    special_token = re.compile(r"^(</s>|__\w+__)$")
+
+    def __init__(self):
+        self.src_lang = None
+
+    def _token_id(self, token):
+        # The leading 0x01 byte keeps the encoding reversible
+        return int.from_bytes(b"\x01" + token.encode("utf-8"), "big")
+
+    def _token(self, token_id):
+        return token_id.to_bytes((token_id.bit_length() + 7) // 8, "big")[1:].decode("utf-8")
+
+    def encode(self, text, add_special_tokens=True):
+        ids = [self._token_id(token) for token in text.split()]
+        if add_special_tokens:
+            ids = self.build_inputs_with_special_tokens(ids)
+        return ids
+
+    def __call__(self, texts, add_special_tokens=True):
+        if isinstance(texts, str):
+            return SimpleNamespace(input_ids=self.encode(texts, add_special_tokens))
+        return SimpleNamespace(
+            input_ids=[self.encode(text, add_special_tokens) for text in texts]
+        )
+
+    def build_inputs_with_special_tokens(self, ids):
+        prefix = [self._token_id(self.get_lang_token(self.src_lang))] if self.src_lang else []
+        return prefix + list(ids) + [self._token_id(self.eos_token)]
+
+    def convert_ids_to_tokens(self, ids):
+        return [self._token(token_id) for token_id in ids]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self._token_id(token) for token in tokens]
+
+    def decode(self, ids, skip_special_tokens=True):
+        tokens = self.convert_ids_to_tokens(ids)
+        if skip_special_tokens:
+            tokens = [t for t in tokens if not self.special_token.match(t)]
+        return " ".join(tokens)
+
+    def get_lang_token(self, lang):
+        return f"__{lang}__"
+
+    def get_vocab(self):
+        # Ids come from the tokens themselves, so every FakeTokenizer is compatible
+        return {}
+
+    def save_pretrained(self, path):
+        pass
+
+
+class FakeTranslator:
+    """Deterministic stand-in for ctranslate2.Translator.
+
+    Echoes the source tokens (after any target prefix) and sleeps
+    `latency_ms` plus `latency_per_token_ms` for every source token in the batch.
+    """
+
+    special_token = FakeTokenizer.special_token
+
+    def __init__(self, latency_ms=FAKE_LATENCY_MS, latency_per_token_ms=FAKE_LATENCY_PER_TOKEN_MS):
+        self.latency_ms = latency_ms
+        self.latency_per_token_ms = latency_per_token_ms
+
+    def translate_batch(self, source, target_prefix=None, **kwargs):
+        total_tokens = sum(len(tokens) for tokens in source)
+        time.sleep((self.latency_ms + self.latency_per_token_ms * total_tokens) / 1000.0)
+        results = []
+        for i, tokens in enumerate(source):
+            hypothesis = list(target_prefix[i]) if target_prefix else []
+            hypothesis += [t for t in tokens if not self.special_token.match(t)]
+            results.append(SimpleNamespace(hypotheses=[hypothesis]))
+        return results
+
+
+# Fake backends share one tokenizer, so pivot legs can pass tokens straight through
+_fake_tokenizer = FakeTokenizer()
+
+
+def load_fake_backend(model_path, multilingual=False):
+    capabilities = {
+        "device": "fake",
+        "multilingual": multilingual,
+        "token_ids": True,
+        "latency_ms": FAKE_LATENCY_MS,
+        "latency_per_token_ms": FAKE_LATENCY_PER_TOKEN_MS,
+    }
+    return TranslationBackend(
+        FakeTranslator(), _fake_tokenizer, os.path.basename(model_path.rstrip("/")), capabilities
+    )
+
+
+def backend_device(direction):
+    if TRANSLATION_BACKEND != "fake" and direction in CPU_DIRECTIONS:
+        return "cpu"
+    return TRANSLATION_BACKEND
+
+
+def load_backend(direction, model_path, tokenizer_name=None, multilingual=False):
+    """Load the model for a direction (or "m2m") on the backend configured for it."""
+    device = backend_device(direction)
+    if device == "fake":
+        backend = load_fake_backend(model_path, multilingual)
+    elif device in ("cuda", "cpu"):
+        backend = load_ct2_backend(model_path, tokenizer_name, device, multilingual)
+    else:
+        raise ValueError(f"Unknown translation backend '{device}'")
+    backend.direction = direction
+    return backend
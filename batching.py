@@ -0,0 +1,115 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "1024"))
+# A key's worker thread exits after this long without requests
+BATCH_IDLE_SECONDS = float(os.getenv("BATCH_IDLE_SECONDS", "60"))
+
+
+class BatchScheduler:
+    """Collects concurrent requests per key and runs them as one batched call.
+
+    `run_batch(key, texts)` must return one result per text, in order.
+    A batch is flushed when it reaches `max_batch_size` or when its oldest
+    request has waited `max_wait_ms`. Each key has one worker thread, which
+    exits once the key has been idle for `idle_seconds`.
+    """
+
+    def __init__(
+        self,
+        run_batch,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        max_queue_size=BATCH_MAX_QUEUE,
+        idle_seconds=BATCH_IDLE_SECONDS,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.idle_seconds = idle_seconds
+        self._queues = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def queue_depth(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, key, text):
+        """Queue a text for translation and return a Future for its result.
+
+        Raises queue.Full when `max_queue_size` requests are already pending.
+        """
+        future = Future()
+        with self._lock:
+            if self._pending >= self.max_queue_size:
+                raise queue.Full("Too many pending translation requests")
+            self._pending += 1
+            key_queue = self._queues.get(key)
+            if key_queue is None:
+                key_queue = queue.Queue()
+                self._queues[key] = key_queue
+                worker = threading.Thread(
+                    target=self._worker, args=(key, key_queue), daemon=True
+                )
+                worker.start()
+            # Under the lock, so an idle worker never retires with a request in its queue
+            key_queue.put((text, future, time.monotonic()))
+        return future
+
+    def translate(self, key, text, timeout=None):
+        return self.submit(key, text).result(timeout=timeout)
+
+    def _collect(self, key, key_queue):
+        # Block for the first request, then fill the batch until it is full
+        # or the first request has waited long enough. None once the key is idle.
+        while True:
+            try:
+                first = key_queue.get(timeout=self.idle_seconds)
+                break
+            except queue.Empty:
+                with self._lock:
+                    if key_queue.empty():
+                        del self._queues[key]
+                        return None
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(key_queue.get_nowait())
+                else:
+                    batch.append(key_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, key, key_queue):
+        while True:
+            batch = self._collect(key, key_queue)
+            if batch is None:
+                return
+            with self._lock:
+                self._pending -= len(batch)
+
+            texts = [text for text, _, _ in batch]
+            try:
+                results = self.run_batch(key, texts)
+                if len(results) != len(texts):
+                    raise RuntimeError(
+                        f"Batch for {key} returned {len(results)} results for {len(texts)} inputs"
+                    )
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
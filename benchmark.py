@@ -0,0 +1,341 @@
+"""
+Offline benchmark for the translation service.
+
+Replays a corpus through translate_with_timing, the /translate endpoint and
+the book worker's process_file on the fake engine and a local S3 stand-in, so numbers are comparable
+across machines, and writes throughput, latency percentiles and peak RSS as
+JSON that can be diffed between commits.
+
+The corpus is the sentences of requests.jsonl (when present) plus synthetic
+corpora of the requested sizes, generated from a fixed seed.
+
+* Run:
+    python benchmark.py --sizes 200,1000 --concurrency 1,4,16 --output bench.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PAIRS = "en-vi,de-vi,en-ko"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--corpus", default="requests.jsonl", help="JSON lines with title/body, skipped if missing")
+    parser.add_argument("--sizes", default="200", help="Sentences per synthetic corpus, comma separated")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--pairs", default=DEFAULT_PAIRS, help="Direct, pivot and m2m pairs by default")
+    parser.add_argument("--scenarios", default="function,http,book")
+    parser.add_argument("--book-sentences", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Fake engine cost per generate call")
+    parser.add_argument("--latency-per-token-ms", type=float, default=0.05, help="Fake engine cost per token")
+    parser.add_argument("--cache", action="store_true", help="Keep the translation memory on")
+    parser.add_argument("--verbose", action="store_true", help="Show the service's own log lines")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, work_dir):
+    # Must run before main / conversion_service are imported; they read the
+    # environment at import time
+    os.environ.update(
+        {
+            "TRANSLATION_BACKEND": "fake",
+            "FAKE_LATENCY_MS": str(args.latency_ms),
+            "FAKE_LATENCY_PER_TOKEN_MS": str(args.latency_per_token_ms),
+            "WARM_MODELS": "",
+            "MAX_RESIDENT_MODELS": "64",
+            "TM_SQLITE_PATH": "",
+            "CHECKPOINT_S3": "false",
+            "CHECKPOINT_DIR": os.path.join(work_dir, "checkpoints"),
+            "METRICS_PORT": "0",
+            "S3_LOCAL_DIR": os.path.join(work_dir, "s3"),
+            # A fresh job store per run; a shared one would find every book DONE
+            "JOB_STORE_PATH": os.path.join(work_dir, "jobs.db"),
+        }
+    )
+    if not args.cache:
+        os.environ["TM_MAX_ENTRIES"] = "0"
+    os.environ.setdefault("MODEL_DIR", os.path.join(work_dir, "models"))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def split_corpus_sentences(text):
+    # Always the regex splitter, so the corpus does not depend on nltk data
+    from chunker import SENTENCE_END
+
+    return [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+
+
+def load_request_corpus(path):
+    if not os.path.exists(path):
+        return []
+    sentences = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                request = json.loads(line)
+                sentences.append(request.get("title", ""))
+                sentences.extend(split_corpus_sentences(request.get("body", "")))
+    return [s for s in sentences if s]
+
+
+def synthetic_corpus(size, seed):
+    """`size` English-like sentences; headings repeat like they do in books."""
+    rng = random.Random(seed)
+    letters = "etaoinshrdlucmfwypvbgk"
+    vocabulary = [
+        "".join(rng.choice(letters) for _ in range(rng.randint(1, 9))) for _ in range(2000)
+    ]
+    sentences = []
+    for i in range(size):
+        if i % 50 == 0:
+            sentences.append(f"CHAPTER {i // 50 + 1}.")
+            continue
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(4, 40))]
+        sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+    return sentences
+
+
+def write_book(path, sentences, seed):
+    # Paragraphs of a few sentences, wrapped at 70 columns like Gutenberg texts
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        i = 0
+        while i < len(sentences):
+            take = rng.randint(1, 6)
+            paragraph = " ".join(sentences[i : i + take])
+            i += take
+            line = ""
+            for word in paragraph.split():
+                if line and len(line) + len(word) + 1 > 70:
+                    f.write(line + "\n")
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            f.write(line + "\n\n")
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q / 100.0 * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_load(fn, items, concurrency):
+    """Call fn on every item from `concurrency` threads and summarize the latencies."""
+    latencies = []
+    lock = threading.Lock()
+
+    def timed(item):
+        start_time = time.perf_counter()
+        fn(item)
+        elapsed = time.perf_counter() - start_time
+        with lock:
+            latencies.append(elapsed)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in executor.map(timed, items):
+            pass
+    seconds = time.perf_counter() - start_time
+
+    latencies.sort()
+    return {
+        "requests": len(items),
+        "seconds": round(seconds, 4),
+        "throughput_per_second": round(len(items) / seconds, 2) if seconds else None,
+        "latency_ms": {
+            name: round(value * 1000, 3)
+            for name, value in (
+                ("p50", percentile(latencies, 50)),
+                ("p95", percentile(latencies, 95)),
+                ("p99", percentile(latencies, 99)),
+                ("mean", sum(latencies) / len(latencies)),
+                ("max", latencies[-1]),
+            )
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def route_kind(route):
+    if len(route) == 2:
+        return "pivot"
+    return "m2m" if route[0][0] == "m2m" else "direct"
+
+
+def benchmark(args, work_dir):
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        import main
+
+    pairs = [tuple(pair.split("-")) for pair in args.pairs.split(",") if pair]
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    scenarios = [s for s in args.scenarios.split(",") if s]
+
+    corpora = {}
+    request_corpus = load_request_corpus(args.corpus)
+    if request_corpus:
+        corpora["requests"] = request_corpus
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        corpora[f"synthetic-{size}"] = synthetic_corpus(size, args.seed)
+
+    # Load every model up front so load time is not counted as latency
+    with quiet:
+        for source_lang, target_lang in pairs:
+            for model_key, _, _ in main.resolve_route(source_lang, target_lang):
+                main.model_registry.get(model_key)
+
+    results = []
+
+    def record(result):
+        results.append(result)
+        latency = result["latency_ms"]
+        print(
+            f"{result['scenario']:8} {result['corpus']:16} {result['pair']} ({result['route']:6}) "
+            f"c={result['concurrency']:<3} {result['throughput_per_second']:>9} /s  "
+            f"p50 {latency['p50']:>9} ms  p95 {latency['p95']:>9} ms  p99 {latency['p99']:>9} ms  "
+            f"rss {result['peak_rss_mb']} MB",
+            file=sys.stderr,
+        )
+
+    client_local = threading.local()
+
+    def http_translate(text, source_lang, target_lang):
+        if not hasattr(client_local, "client"):
+            client_local.client = main.app.test_client()
+        response = client_local.client.post(
+            "/translate",
+            json={"text": text, "source_lang": source_lang, "target_lang": target_lang},
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"/translate returned {response.status_code}")
+
+    for source_lang, target_lang in pairs:
+        kind = route_kind(main.resolve_route(source_lang, target_lang))
+        for corpus_name, sentences in corpora.items():
+            for scenario, fn in (
+                ("function", main.translate_with_timing),
+                ("http", http_translate),
+            ):
+                if scenario not in scenarios:
+                    continue
+                for concurrency in levels:
+                    with quiet:
+                        result = run_load(
+                            lambda text: fn(text, source_lang, target_lang), sentences, concurrency
+                        )
+                    result.update(
+                        scenario=scenario,
+                        corpus=corpus_name,
+                        pair=f"{source_lang}-{target_lang}",
+                        route=kind,
+                        concurrency=concurrency,
+                    )
+                    record(result)
+
+    if "book" in scenarios:
+        with quiet:
+            import conversion_service
+
+        # Books go through the directory-backed S3 stand-in (S3_LOCAL_DIR)
+        from s3_transfer import get_s3_client
+
+        conversion_service.send_secure_email = lambda *args, **kwargs: None
+
+        book_path = os.path.join(work_dir, "book.txt")
+        book_sentences = synthetic_corpus(args.book_sentences, args.seed)
+        write_book(book_path, book_sentences, args.seed)
+        get_s3_client().upload_file(book_path, "bench", "book.txt")
+
+        with quiet:
+            for source_lang, target_lang in pairs:
+                for model_key, _, _ in conversion_service.resolve_route(source_lang, target_lang):
+                    conversion_service.model_registry.get(model_key)
+
+        for source_lang, target_lang in pairs:
+            kind = route_kind(conversion_service.resolve_route(source_lang, target_lang))
+            for concurrency in levels:
+                # One book per worker, like SQS_WORKERS jobs running side by side
+                jobs = [f"bench-{source_lang}-{target_lang}-{concurrency}-{i}" for i in range(concurrency)]
+
+                def process(unique_id):
+                    conversion_service.process_file(
+                        "bench", "book.txt", source_lang, target_lang, unique_id, "bench@example.com"
+                    )
+
+                with quiet:
+                    result = run_load(process, jobs, concurrency)
+                result.update(
+                    scenario="book",
+                    corpus=f"book-{args.book_sentences}",
+                    pair=f"{source_lang}-{target_lang}",
+                    route=kind,
+                    concurrency=concurrency,
+                    sentences_per_second=round(
+                        len(book_sentences) * len(jobs) / result["seconds"], 2
+                    ),
+                )
+                record(result)
+
+    return results, {name: len(sentences) for name, sentences in corpora.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="translation-bench-")
+    try:
+        configure_environment(args, work_dir)
+        results, corpora = benchmark(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": vars(args),
+        "corpora": corpora,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_cli()
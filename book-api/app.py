@@ -1,54 +1,159 @@
-from flask import Flask, jsonify, request, send_from_directory, send_file
-import pandas as pd
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+from functools import lru_cache
+
+from flask import Flask, Response, abort, jsonify, request, send_from_directory, send_file
+
+from catalog import CATALOG_CSV, CATALOG_PATH, load_catalog
+from search_index import BookIndex, FACET_COLUMNS
+
+# Browser/proxy cache lifetime of /api/filters; responses only change with the catalog
+FILTERS_MAX_AGE = int(os.getenv('FILTERS_MAX_AGE', '3600'))
+# Distinct /api/filters queries whose response bodies are kept in memory
+FILTERS_CACHE_SIZE = int(os.getenv('FILTERS_CACHE_SIZE', '1024'))
+# How often to check the catalog files for a new version (0 turns the watcher off)
+CATALOG_WATCH_SECONDS = float(os.getenv('CATALOG_WATCH_SECONDS', '30'))
+# Required in X-Admin-Token by POST /admin/reload; the endpoint is off when unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+# /api/filters query args besides the column filters
+FILTERS_ARGS = ['search', 'prefix', 'facet', 'limit']
 
 app = Flask(__name__, static_url_path='', static_folder='static')
 
-# Load the book data
-book_data = pd.read_csv('book_info_final.csv').fillna('')
+reload_lock = threading.Lock()
 
-# Helper function to get distinct values for filtering
-def get_distinct_values(column):
-    return book_data[column].dropna().unique().tolist()
+def catalog_stamp():
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in (CATALOG_CSV, CATALOG_PATH))
+
+# Load the book data
+# Built once per catalog; requests only look up the index
+book_index = BookIndex(load_catalog())
+# Bumped by every reload; keys the cached /api/filters bodies instead of the
+# index itself, so the cache never keeps a replaced catalog alive
+catalog_generation = 0
+# Taken after loading, which may have written the binary catalog
+loaded_stamp = catalog_stamp()
 
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 50))
+    page = max(1, int(request.args.get('page', 1)))
+    per_page = max(1, int(request.args.get('per_page', 50)))
     search_query = request.args.get('search', '')
-    
+
     filters = {}
     for key in request.args.keys():
         if key not in ['page', 'per_page', 'search']:
             filters[key] = request.args.get(key)
 
-    filtered_data = book_data
+    books_json = book_index.search(search_query, filters, offset=(page - 1) * per_page, limit=per_page)
+
+    return jsonify(books_json)
+
+@lru_cache(maxsize=FILTERS_CACHE_SIZE)
+def filters_body(generation, args):
+    """JSON body and ETag of /api/filters for a sorted tuple of query args.
 
-    if search_query:
-        filtered_data = filtered_data[
-            filtered_data.apply(lambda row: search_query.lower() in row.astype(str).str.lower().to_string(), axis=1)
-        ]
+    Built on the current index. A request that read `generation` just before
+    a reload can only add a body under the old generation, which no later
+    request looks up.
+    """
+    index = book_index
+    args = dict(args)
+    search_query = args.pop('search', '')
+    prefix = args.pop('prefix', '')
+    columns = [args.pop('facet')] if 'facet' in args else FACET_COLUMNS
+    # Typeahead only needs the top few values
+    limit = int(args.pop('limit', 20 if prefix else 0))
+    filters = args
 
-    for column, value in filters.items():
-        if value:
-            filtered_data = filtered_data[filtered_data[column].str.contains(value, case=False, na=False)]
+    facets = {
+        column: [{'value': value, 'count': count} for value, count in
+                 index.facet(column, search_query, filters, prefix=prefix, limit=limit)]
+        for column in columns
+    }
+    body = json.dumps(facets, ensure_ascii=False, separators=(',', ':'))
+    return body, hashlib.sha1(body.encode('utf-8')).hexdigest()
 
-    start = (page - 1) * per_page
-    end = start + per_page
+# The full lists are the front page's request; serialize them at load
+filters_body(catalog_generation, ())
 
-    books_slice = filtered_data[start:end]
+def reload_catalog():
+    """Index the catalog on disk and swap it in.
 
-    books_json = books_slice.to_dict(orient='records')
+    The new index is built beside the old one; requests that already hold the
+    old index finish on it and later ones use the new one.
+    """
+    global book_index, catalog_generation, loaded_stamp
+    with reload_lock:
+        start_time = time.perf_counter()
+        index = BookIndex(load_catalog())
+        # The index first, so a request seeing the new generation builds on the new index
+        book_index = index
+        catalog_generation += 1
+        loaded_stamp = catalog_stamp()
+        filters_body.cache_clear()
+        filters_body(catalog_generation, ())
+    print(f'Loaded catalog of {len(index)} books in {time.perf_counter() - start_time:.2f}s')
+    return index
 
-    return jsonify(books_json)
+def watch_catalog():
+    # Reload once the files have stopped changing for a poll, so a catalog
+    # still being copied in is not picked up half written
+    previous = loaded_stamp
+    while True:
+        time.sleep(CATALOG_WATCH_SECONDS)
+        stamp = catalog_stamp()
+        if stamp != loaded_stamp and stamp == previous:
+            try:
+                reload_catalog()
+            except Exception as e:
+                print(f'Failed to reload catalog: {e}')
+        previous = stamp
+
+if CATALOG_WATCH_SECONDS > 0:
+    threading.Thread(target=watch_catalog, daemon=True).start()
 
 @app.route('/api/filters', methods=['GET'])
 def get_filters():
-    filters = {
-        'Author': get_distinct_values('Author'),
-        'LoC Class': get_distinct_values('LoC Class'),
-        'Subjects': get_distinct_values('Subjects')
-    }
-    return jsonify(filters)
+    """Facet values with their counts, for the books matching the search and filters if any.
+
+    Query args: search, prefix (values starting with it), facet (one column),
+    limit, and any other column as a filter like /api/books.
+    """
+    generation = catalog_generation
+    index = book_index
+    # Other args would not change the response, only add cache entries
+    args = {key: value for key, value in request.args.items()
+            if value and (key in FILTERS_ARGS or key in index.catalog.arrays)}
+    if 'facet' in args and args['facet'] not in FACET_COLUMNS:
+        abort(400, f'Unknown facet {args["facet"]}')
+    if 'limit' in args:
+        try:
+            limit = int(args['limit'])
+        except ValueError:
+            abort(400, 'limit must be an integer')
+        if limit < 0:
+            abort(400, 'limit must not be negative')
+        args['limit'] = str(limit)
+    body, etag = filters_body(generation, tuple(sorted(args.items())))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = FILTERS_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        abort(403)
+    index = reload_catalog()
+    return jsonify({'books': len(index)})
 
 @app.route('/covers/<path:filename>')
 def serve_cover_image(filename):
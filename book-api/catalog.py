@@ -0,0 +1,131 @@
+"""
+Columnar book catalog.
+
+Every column is kept as the scraped text, dictionary-encoded (each distinct
+string stored once plus an int32 code per book), so a column has the same
+type whatever the rows hold. Download counts are also parsed into an integer
+array for sorting. The catalog is saved as an uncompressed .npz next to the
+scraped CSV, which loads much faster than parsing the CSV and needs neither
+pandas nor pickle.
+
+* Convert a freshly scraped catalog:
+    python catalog.py book_info_final.csv catalog.npz
+"""
+
+import os
+import re
+import csv
+import sys
+
+import numpy as np
+
+CATALOG_CSV = os.getenv('CATALOG_CSV', 'book_info_final.csv')
+CATALOG_PATH = os.getenv('CATALOG_PATH', 'catalog.npz')
+
+FORMAT_VERSION = 2
+# Separates dictionary strings in the saved file; never appears in scraped text
+SEPARATOR = '\x00'
+
+
+def parse_downloads(value):
+    # The scraper stores e.g. "1234 downloads in the last 30 days."
+    match = re.search(r'\d+', str(value).replace(',', ''))
+    return int(match.group()) if match else 0
+
+
+def encode(values):
+    """(dictionary, int32 codes) for a list of strings."""
+    codes = {}
+    encoded = np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int32, count=len(values))
+    return list(codes), encoded
+
+
+class Catalog:
+    """The catalog's columns; `dictionaries` holds each column's strings, `arrays` their codes.
+
+    `downloads` is the parsed Downloads count of every book.
+    """
+
+    def __init__(self, columns, arrays, dictionaries, downloads):
+        self.columns = columns
+        self.arrays = arrays
+        self.dictionaries = dictionaries
+        self.downloads = downloads
+
+    def __len__(self):
+        return len(self.downloads)
+
+    def record(self, row):
+        return {column: self.dictionaries[column][self.arrays[column][row]] for column in self.columns}
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            columns = next(reader)
+            rows = [row + [''] * (len(columns) - len(row)) for row in reader if row]
+        arrays = {}
+        dictionaries = {}
+        for i, column in enumerate(columns):
+            dictionaries[column], arrays[column] = encode([row[i] for row in rows])
+        if 'Downloads' in dictionaries:
+            counts = [parse_downloads(value) for value in dictionaries['Downloads']]
+            downloads = np.array(counts, dtype=np.int64)[arrays['Downloads']]
+        else:
+            downloads = np.zeros(len(rows), dtype=np.int64)
+        return cls(columns, arrays, dictionaries, downloads)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format']) != FORMAT_VERSION:
+                raise ValueError(f'{path} is catalog format {int(data["format"])}, expected {FORMAT_VERSION}')
+            columns = data['columns'].tolist()
+            arrays = {}
+            dictionaries = {}
+            for i, column in enumerate(columns):
+                dictionaries[column] = data[f'values{i}'].tobytes().decode('utf-8').split(SEPARATOR)
+                arrays[column] = data[f'column{i}']
+            downloads = data['downloads']
+        return cls(columns, arrays, dictionaries, downloads)
+
+    def save(self, path):
+        """Write the catalog to `path` atomically, so a running server never reads half a file."""
+        data = {'format': np.array(FORMAT_VERSION), 'columns': np.array(self.columns), 'downloads': self.downloads}
+        for i, column in enumerate(self.columns):
+            data[f'column{i}'] = self.arrays[column]
+            blob = SEPARATOR.join(self.dictionaries[column]).encode('utf-8')
+            data[f'values{i}'] = np.frombuffer(blob, dtype=np.uint8)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def load_catalog(csv_path=CATALOG_CSV, path=CATALOG_PATH):
+    """The binary catalog, rebuilt from the CSV first when the CSV is newer or the file is an older format."""
+    if os.path.exists(path) and (not os.path.exists(csv_path) or os.path.getmtime(path) >= os.path.getmtime(csv_path)):
+        try:
+            return Catalog.load(path)
+        except (KeyError, ValueError) as e:
+            if not os.path.exists(csv_path):
+                raise
+            print(f'Rebuilding {path} from {csv_path}: {e}')
+    catalog = Catalog.from_csv(csv_path)
+    try:
+        catalog.save(path)
+    except OSError as e:
+        print(f'Failed to save catalog to {path}: {e}')
+    return catalog
+
+
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else CATALOG_CSV
+    path = sys.argv[2] if len(sys.argv) > 2 else CATALOG_PATH
+    catalog = Catalog.from_csv(csv_path)
+    catalog.save(path)
+    print(f'Wrote {len(catalog)} books to {path}')
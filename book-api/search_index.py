@@ -0,0 +1,203 @@
+"""
+In-memory search index for the book catalog.
+
+Built once when the catalog is loaded so requests never scan the catalog:
+an inverted token index over Title, Author and Subjects and, per facet
+column, the set of rows holding each value.
+A query intersects those row sets, ranks the matches and only orders as many
+as the requested page needs. Facet value counts for the whole catalog are
+computed here too; counts for a search are tallied from its matching rows.
+"""
+
+import re
+import heapq
+import bisect
+from functools import lru_cache
+
+import numpy as np
+
+TOKEN = re.compile(r'\w+')
+# A match in the title counts more than one in the subjects
+SEARCH_WEIGHTS = {'Title': 3, 'Author': 2, 'Subjects': 1}
+FACET_COLUMNS = ['Author', 'LoC Class', 'Subjects']
+SUBJECT_SEPARATOR = '; '
+# Shorter query terms only match whole tokens; prefixes of one or two letters match half the catalog
+MIN_PREFIX = 3
+# Filter values whose matching rows are kept per index
+FILTER_CACHE_SIZE = 256
+
+
+def tokenize(text):
+    return TOKEN.findall(str(text).lower())
+
+
+def facet_values(column, value):
+    """The facet values of one cell; Subjects holds several joined with "; "."""
+    if not value:
+        return []
+    if column == 'Subjects':
+        return [v.strip() for v in str(value).split(SUBJECT_SEPARATOR) if v.strip()]
+    return [str(value)]
+
+
+class BookIndex:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lower = {}
+        self._filter_rows = lru_cache(maxsize=FILTER_CACHE_SIZE)(self._scan_filter)
+        self.downloads = catalog.downloads.tolist()
+
+        # token -> {row: weight}
+        self.postings = {}
+        for column, weight in SEARCH_WEIGHTS.items():
+            if column not in catalog.arrays:
+                continue
+            # Tokenized once per distinct value
+            tokens = [set(tokenize(value)) for value in catalog.dictionaries[column]]
+            for row, code in enumerate(catalog.arrays[column].tolist()):
+                for token in tokens[code]:
+                    rows = self.postings.setdefault(token, {})
+                    rows[row] = rows.get(row, 0) + weight
+        self.tokens = sorted(self.postings)
+
+        # column -> lowercase value -> set of rows, with one display spelling per value
+        # and each row's values for counting facets over a result set
+        self.facets = {}
+        self.facet_labels = {}
+        self.row_facets = {}
+        for column in FACET_COLUMNS:
+            if column not in catalog.arrays:
+                continue
+            values = self.facets[column] = {}
+            labels = self.facet_labels[column] = {}
+            row_values = self.row_facets[column] = []
+            distinct_keys = []
+            for value in catalog.dictionaries[column]:
+                keys = []
+                for label in facet_values(column, value):
+                    key = label.lower()
+                    labels.setdefault(key, label)
+                    keys.append(key)
+                distinct_keys.append(tuple(dict.fromkeys(keys)))
+            for row, code in enumerate(catalog.arrays[column].tolist()):
+                keys = distinct_keys[code]
+                for key in keys:
+                    values.setdefault(key, set()).add(row)
+                row_values.append(keys)
+        # Values sorted by key for prefix lookups, and by count for the full lists
+        self.facet_keys = {column: sorted(values) for column, values in self.facets.items()}
+        self.facet_counts = {
+            column: sorted(((key, len(rows)) for key, rows in values.items()), key=lambda kv: (-kv[1], kv[0]))
+            for column, values in self.facets.items()
+        }
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def _term_scores(self, term):
+        """{row: score} for rows with a token equal to, or starting with, `term`."""
+        scores = {}
+        exact = self.postings.get(term)
+        if exact:
+            # Whole-token matches rank above prefix matches
+            scores = {row: weight * 2 for row, weight in exact.items()}
+        if len(term) < MIN_PREFIX:
+            return scores
+        i = bisect.bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            token = self.tokens[i]
+            i += 1
+            if token == term:
+                continue
+            for row, weight in self.postings[token].items():
+                if weight > scores.get(row, 0):
+                    scores[row] = weight
+        return scores
+
+    def _scan_filter(self, column, value):
+        """Rows whose `column` contains `value`, ignoring case, like str.contains.
+
+        Subjects=Fiction matches "Science Fiction" too, whether or not
+        "fiction" is a facet value of its own.
+        """
+        value = value.lower()
+        # Each distinct string is checked once, then mapped to its rows through the codes
+        if column not in self._lower:
+            self._lower[column] = [cell.lower() for cell in self.catalog.dictionaries[column]]
+        codes = [code for code, cell in enumerate(self._lower[column]) if value in cell]
+        return frozenset(np.flatnonzero(np.isin(self.catalog.arrays[column], codes)).tolist())
+
+    def _match(self, query, filters):
+        """(rows, scores) for a query: rows is None when everything matches, scores is None without search terms."""
+        candidates = None
+        for column, value in (filters or {}).items():
+            if not value or column not in self.catalog.arrays:
+                continue
+            rows = self._filter_rows(column, value.lower())
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return set(), None
+
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return candidates, None
+
+        # Narrowest term first so later terms only look up surviving rows
+        term_scores = sorted((self._term_scores(term) for term in terms), key=len)
+        scores = term_scores[0]
+        if candidates is not None:
+            scores = {row: score for row, score in scores.items() if row in candidates}
+        for other in term_scores[1:]:
+            scores = {row: score + other[row] for row, score in scores.items() if row in other}
+            if not scores:
+                break
+        return scores.keys(), scores
+
+    def search(self, query='', filters=None, offset=0, limit=50):
+        """One page of matching records, best match first, then most downloaded.
+
+        Without a query the catalog order is kept.
+        """
+        rows, scores = self._match(query, filters)
+        end = offset + limit
+        if rows is None:
+            page = range(offset, min(end, len(self.catalog)))
+        elif scores is None:
+            page = heapq.nsmallest(end, rows)[offset:]
+        else:
+            downloads = self.downloads
+            page = heapq.nsmallest(end, scores, key=lambda row: (-scores[row], -downloads[row], row))[offset:]
+        return [self.catalog.record(row) for row in page]
+
+    def facet(self, column, query='', filters=None, prefix='', limit=None):
+        """[(value, count)] for one facet column, most common first.
+
+        Counts cover the books matching `query` and `filters` (the whole
+        catalog when both are empty); `prefix` keeps values starting with it.
+        """
+        if column not in self.facets:
+            return []
+        prefix = prefix.lower()
+        rows, _ = self._match(query, filters)
+        if rows is None:
+            counts = self.facet_counts[column]
+            if prefix:
+                keys = self.facet_keys[column]
+                i = bisect.bisect_left(keys, prefix)
+                matching = set()
+                while i < len(keys) and keys[i].startswith(prefix):
+                    matching.add(keys[i])
+                    i += 1
+                counts = [(key, count) for key, count in counts if key in matching]
+        else:
+            tally = {}
+            row_values = self.row_facets[column]
+            for row in rows:
+                for key in row_values[row]:
+                    if key.startswith(prefix):
+                        tally[key] = tally.get(key, 0) + 1
+            counts = sorted(tally.items(), key=lambda kv: (-kv[1], kv[0]))
+        if limit:
+            counts = counts[:limit]
+        labels = self.facet_labels[column]
+        return [(labels[key], count) for key, count in counts]
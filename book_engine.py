@@ -0,0 +1,202 @@
+import os
+import itertools
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS
+from translation_memory import normalize_text
+
+# Padded tokens per generate call (longest chunk * batch size) and a hard cap on chunks
+BOOK_BATCH_TOKENS = int(os.getenv("BOOK_BATCH_TOKENS", "8192"))
+BOOK_BATCH_MAX_SIZE = int(os.getenv("BOOK_BATCH_MAX_SIZE", "64"))
+# Chunks translated per window when streaming a book; bounds memory per job
+BOOK_WINDOW_CHUNKS = int(os.getenv("BOOK_WINDOW_CHUNKS", "1024"))
+# A paragraph longer than this is handed on in pieces instead of growing further
+PARAGRAPH_MAX_CHARS = int(os.getenv("PARAGRAPH_MAX_CHARS", "200000"))
+# Memory a book job spends remembering translations of repeated chunks; fixed
+# whatever the book's size, so the least recently repeated chunks are dropped
+BOOK_DEDUP_MAX_MB = float(os.getenv("BOOK_DEDUP_MAX_MB", "4"))
+MB = 1024 * 1024
+
+
+def plan_batches(lengths, max_batch_tokens=BOOK_BATCH_TOKENS, max_batch_size=BOOK_BATCH_MAX_SIZE):
+    """Group indices into batches of similar length.
+
+    Indices are sorted by length and a batch grows while its padded size
+    (longest length * number of items) stays within `max_batch_tokens`, so
+    short chunks get large batches and long chunks small ones.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        length = max(1, lengths[i])
+        # Sorted ascending, so the new item is the longest in the batch
+        if batch and (
+            len(batch) >= max_batch_size or length * (len(batch) + 1) > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def translate_chunks(chunks, translate_batch, max_batch_tokens=BOOK_BATCH_TOKENS, max_batch_size=BOOK_BATCH_MAX_SIZE):
+    """Translate (text, token_ids) chunks in length buckets and return results in input order.
+
+    `translate_batch(texts, token_ids)` translates one bucket and returns one
+    string per input.
+    """
+    lengths = [
+        len(token_ids) if token_ids is not None else len(text.split())
+        for text, token_ids in chunks
+    ]
+    results = [None] * len(chunks)
+    for batch in plan_batches(lengths, max_batch_tokens, max_batch_size):
+        translated = translate_batch(
+            [chunks[i][0] for i in batch], [chunks[i][1] for i in batch]
+        )
+        for i, translated_text in zip(batch, translated):
+            results[i] = translated_text
+    return results
+
+
+class ChunkDedup:
+    """Book-scoped cache so each distinct chunk is translated once.
+
+    Chunks are keyed by their normalized text. Repeats within a window share
+    one model call, and repeats of chunks from earlier windows reuse the
+    stored translation while it is among the most recently used `max_bytes`
+    of text and translations.
+    """
+
+    def __init__(self, max_bytes=BOOK_DEDUP_MAX_MB * MB):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.translated = 0
+        self._translations = OrderedDict()
+        self._bytes = 0
+
+    def translate(self, chunks, translate):
+        """Translate (text, token_ids) chunks with `translate(chunks)`, once per distinct text."""
+        keys = [normalize_text(text) for text, _ in chunks]
+        results = [None] * len(chunks)
+        pending = {}
+        for i, key in enumerate(keys):
+            if key in self._translations:
+                self._translations.move_to_end(key)
+                results[i] = self._translations[key]
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending:
+            first = [indices[0] for indices in pending.values()]
+            for key, translated_text in zip(pending, translate([chunks[i] for i in first])):
+                for i in pending[key]:
+                    results[i] = translated_text
+                self._translations[key] = translated_text
+                self._bytes += self._size(key, translated_text)
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._size(*self._translations.popitem(last=False))
+
+        self.total += len(chunks)
+        self.translated += len(pending)
+        CACHE_LOOKUPS.inc(len(chunks) - len(pending), cache="book", result="hit")
+        CACHE_LOOKUPS.inc(len(pending), cache="book", result="miss")
+        return results
+
+    @staticmethod
+    def _size(key, translated_text):
+        return len(key.encode("utf-8")) + len(translated_text.encode("utf-8"))
+
+    def ratio(self):
+        """Share of chunks that did not need their own translation."""
+        return 1 - self.translated / self.total if self.total else 0.0
+
+
+def iter_book_lines(file, max_chars=PARAGRAPH_MAX_CHARS):
+    """Yield the lines of a text file with wrapped paragraph lines joined.
+
+    Consecutive non-blank lines are joined with a space and blank lines are
+    kept; the file is read one line at a time.
+    """
+    paragraph = []
+    paragraph_chars = 0
+    previous = None
+    for line in itertools.chain(file, [None]):
+        if previous is not None:
+            if previous.strip() == "":
+                yield previous
+            elif line is not None and line.strip() != "":
+                paragraph.append(previous.rstrip() + " ")
+                paragraph_chars += len(paragraph[-1])
+                if paragraph_chars >= max_chars:
+                    yield "".join(paragraph)
+                    paragraph = []
+                    paragraph_chars = 0
+            else:
+                paragraph.append(previous if line is not None else previous.rstrip() + " ")
+                yield "".join(paragraph)
+                paragraph = []
+                paragraph_chars = 0
+        previous = line
+
+
+def iter_windows(lines, chunk_line, max_chunks=BOOK_WINDOW_CHUNKS):
+    """Group lines into windows of about `max_chunks` chunks.
+
+    Yields lists of (line, chunks); blank lines get no chunks. A window only
+    ends between lines, so every line is translated within one window.
+    """
+    window = []
+    window_chunks = 0
+    for line in lines:
+        chunks = chunk_line(line) if line.strip() else []
+        window.append((line, chunks))
+        window_chunks += len(chunks)
+        if window_chunks >= max_chunks:
+            yield window
+            window = []
+            window_chunks = 0
+    if window:
+        yield window
+
+
+def translate_book_stream(lines, chunk_line, translate_batch, max_chunks=BOOK_WINDOW_CHUNKS, journal=None, on_window=None, dedup=None):
+    """Yield translated lines in order, translating one window of chunks at a time.
+
+    With a `journal` (see checkpoint.ChunkJournal), chunks recorded by an
+    earlier run are reused and every translated window is recorded before its
+    lines are yielded. `on_window(chunks)` is called with the window's chunk
+    count after each window is recorded.
+    With a `dedup` (ChunkDedup), repeated chunks are translated only once.
+    """
+    next_index = 0
+    for window in iter_windows(lines, chunk_line, max_chunks):
+        flat_chunks = [chunk for _, chunks in window for chunk in chunks]
+        first_index = next_index
+        next_index += len(flat_chunks)
+
+        done = journal.get_many(first_index, next_index) if journal is not None else {}
+        todo = [i for i in range(len(flat_chunks)) if first_index + i not in done]
+        results = [done.get(first_index + i) for i in range(len(flat_chunks))]
+        if todo:
+            todo_chunks = [flat_chunks[i] for i in todo]
+            if dedup is not None:
+                translated = dedup.translate(todo_chunks, lambda chunks: translate_chunks(chunks, translate_batch))
+            else:
+                translated = translate_chunks(todo_chunks, translate_batch)
+            for i, translated_text in zip(todo, translated):
+                results[i] = translated_text
+            if journal is not None:
+                journal.record_many({first_index + i: results[i] for i in todo})
+        if on_window is not None:
+            on_window(len(flat_chunks))
+
+        translated = iter(results)
+        for line, chunks in window:
+            if not chunks:
+                yield "\n"
+            else:
+                yield "".join(next(translated) + "\n" for _ in chunks)
@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "/tmp/checkpoints")
+# Upload the journal next to the source in S3 so another worker can resume it
+CHECKPOINT_S3 = os.getenv("CHECKPOINT_S3", "true").lower() == "true"
+CHECKPOINT_UPLOAD_SECONDS = float(os.getenv("CHECKPOINT_UPLOAD_SECONDS", "60"))
+
+
+def checkpoint_key(unique_id):
+    return f"checkpoints/{unique_id}.db"
+
+
+class ChunkJournal:
+    """Durable record of the chunks of one book job that are already translated.
+
+    Chunks are keyed by their index in the book. The journal also stores a
+    fingerprint of the settings that decide how the book is chunked; a journal
+    written with different settings is discarded since its indices would not
+    line up.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (idx INTEGER PRIMARY KEY, translation TEXT NOT NULL)"
+        )
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is not None and row[0] != fingerprint:
+            print(f"Discarding checkpoint {path}: chunking settings changed")
+            self._conn.execute("DELETE FROM chunks")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,)
+        )
+        self._conn.commit()
+
+    def count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def get_many(self, start, stop):
+        """Return {index: translation} for recorded chunks with start <= index < stop."""
+        rows = self._conn.execute(
+            "SELECT idx, translation FROM chunks WHERE idx >= ? AND idx < ?", (start, stop)
+        )
+        return dict(rows.fetchall())
+
+    def record_many(self, translations):
+        # One transaction per call, so a window of chunks is saved together
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks (idx, translation) VALUES (?, ?)",
+            translations.items(),
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class S3JournalSync:
+    """Keeps a copy of a local journal in S3, uploading at most every `interval` seconds."""
+
+    def __init__(self, s3_client, bucket, unique_id, interval=CHECKPOINT_UPLOAD_SECONDS):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = checkpoint_key(unique_id)
+        self.interval = interval
+        self._last_upload = time.time()
+
+    def download(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            self.s3_client.download_file(self.bucket, self.key, path)
+            print(f"Resuming from checkpoint s3://{self.bucket}/{self.key}")
+            return True
+        except Exception:
+            return False
+
+    def upload(self, path, force=False):
+        if not force and time.time() - self._last_upload < self.interval:
+            return
+        try:
+            self.s3_client.upload_file(path, self.bucket, self.key)
+            self._last_upload = time.time()
+        except Exception as e:
+            print(f"Failed to upload checkpoint {self.key}: {e}")
+
+    def delete(self):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+        except Exception as e:
+            print(f"Failed to delete checkpoint {self.key}: {e}")
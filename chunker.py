@@ -0,0 +1,90 @@
+import re
+
+from nltk.tokenize import sent_tokenize
+
+# Languages with a punkt model in nltk; others use the punctuation split below
+PUNKT_LANGUAGES = {"en": "english", "de": "german", "es": "spanish", "fr": "french"}
+# Latin punctuation only ends a sentence before whitespace, so "3.14", "U.S."
+# and URLs stay whole; full-width CJK marks end one with or without a space
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|(?<=[。！？])\s*")
+
+
+def _locate(text, sentences):
+    # punkt returns slices of the text; find their offsets in order
+    spans = []
+    position = 0
+    for sentence in sentences:
+        start = text.find(sentence, position)
+        if start < 0:
+            return None
+        position = start + len(sentence)
+        spans.append((start, position))
+    return spans
+
+
+def sentence_spans(text, lang="en"):
+    """(start, end) offsets of the sentences of `text`, without surrounding whitespace."""
+    if lang in PUNKT_LANGUAGES:
+        try:
+            spans = _locate(text, sent_tokenize(text, language=PUNKT_LANGUAGES[lang]))
+            if spans is not None:
+                return spans
+        except LookupError:
+            # punkt data is not downloaded on this machine
+            pass
+    spans = []
+    start = 0
+    for match in list(SENTENCE_END.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        segment = text[start:end]
+        if segment.strip():
+            left = start + len(segment) - len(segment.lstrip())
+            spans.append((left, start + len(segment.rstrip())))
+        if match:
+            start = match.end()
+    return spans
+
+
+def split_sentences(text, lang="en"):
+    return [text[start:end] for start, end in sentence_spans(text, lang)]
+
+
+def chunk_text(text, tokenizer, max_tokens=400, lang="en"):
+    """Pack whole sentences into chunks of at most `max_tokens` tokens.
+
+    Returns a list of (chunk_text, token_ids) where token_ids has no special
+    tokens, so the translator can use it without encoding the chunk again.
+    Each sentence is tokenized once; only a sentence longer than the budget
+    is split on token boundaries.
+    """
+    spans = sentence_spans(text, lang)
+    if not spans:
+        return []
+    sentence_ids = tokenizer([text[start:end] for start, end in spans], add_special_tokens=False).input_ids
+
+    chunks = []
+    current_spans = []
+    current_ids = []
+
+    def flush():
+        # Sliced from the source so the whitespace between sentences is kept
+        if current_spans:
+            chunks.append((text[current_spans[0][0]:current_spans[-1][1]], current_ids))
+
+    for span, ids in zip(spans, sentence_ids):
+        if len(ids) > max_tokens:
+            flush()
+            current_spans, current_ids = [], []
+            for i in range(0, len(ids), max_tokens):
+                window = ids[i:i + max_tokens]
+                chunks.append((tokenizer.decode(window, skip_special_tokens=True), window))
+            continue
+
+        if current_ids and len(current_ids) + len(ids) > max_tokens:
+            flush()
+            current_spans, current_ids = [], []
+        current_spans.append(span)
+        current_ids.extend(ids)
+
+    flush()
+    return chunks
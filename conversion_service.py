@@ -1,16 +1,25 @@
 import os
-import time
-import json
+import io
 import boto3
 import uuid
 from threading import Thread
 from nltk.tokenize import sent_tokenize
-from hf_hub_ctranslate2 import MultiLingualTranslatorCT2fromHfHub, TranslatorCT2fromHfHub
-from transformers import AutoTokenizer
 from dotenv import load_dotenv
+from backends import load_backend
+from model_registry import ModelRegistry, WARM_MODELS, parse_warm_models
+from translation_memory import TranslationMemory
+from pivot import translate_pivot_batch
+from token_batches import translate_ids_batch
+from chunker import chunk_text
+from book_engine import ChunkDedup, iter_book_lines, translate_book_stream
+from sqs_consumer import Deferred, InvalidMessage, SQSConsumer
+from job_scheduler import FairScheduler, job_priority
+from metrics import METRICS_PORT, QUEUE_DEPTH, start_http_server
+from s3_transfer import LineStream, get_s3_client, presigned_url, read_text_object, upload_stream
+from job_store import DONE, FAILED, QUEUED, JobLease, JobProgress, JobStore
+from checkpoint import CHECKPOINT_DIR, CHECKPOINT_S3, ChunkJournal, S3JournalSync
 from sendmail import send_secure_email  # Ensure this is your function for sending emails
 import re
-from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -22,7 +31,7 @@ S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 EMAIL = os.getenv("EMAIL")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 sqs = boto3.client('sqs', region_name=AWS_REGION)
-s3 = boto3.client('s3', region_name=AWS_REGION)
+s3 = get_s3_client()
 
 # Load the base model names from the configuration file
 def load_model_names(file_path):
@@ -40,194 +49,235 @@ direct_model_mapping = {
 }
 supported_langs = ["en", "es", "fr", "de", "zh", "vi", "ko", "th", "ja"]
 model_name = "michaelfeil_ct2fast-m2m100_1.2B"
-model_dir = os.path.join(weights_relative_path, model_name)
-os.makedirs(model_dir, exist_ok=True)
-
-# Initialize the model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained("facebook/m2m100_1.2B")
-model_m2m = MultiLingualTranslatorCT2fromHfHub(
-    model_name_or_path="michaelfeil/ct2fast-m2m100_1.2B",
-    device="cuda",
-    compute_type="int8_float16",
-    tokenizer=tokenizer,
-)
-tokenizer.save_pretrained(model_dir)
-if hasattr(model_m2m, "save_pretrained"):
-    model_m2m.save_pretrained(model_dir)
-else:
-    print("The model does not support the 'save_pretrained' method. Please implement a custom saving mechanism.")
-
-print(f"Model and tokenizer have been saved to '{model_dir}'")
-
-def split_text(text, max_length, tokenizer):
-    tokens = tokenizer.encode(text, add_special_tokens=False)
-    chunks = [tokens[i:i + max_length] for i in range(0, len(tokens), max_length)]
-    return [tokenizer.decode(chunk, skip_special_tokens=True) for chunk in chunks]
-
-# Translation functions
-def translate_text(sentences, src_lang, tgt_lang):
-    outputs = model_m2m.generate([sentences], src_lang=[src_lang], tgt_lang=[tgt_lang])
-    return outputs[0]
-
-def translate_with_timing(text, source_lang, target_lang):
-    def perform_translation(text, model_dir):
-        model = TranslatorCT2fromHfHub(
-            model_name_or_path=model_dir,
-            device="cuda",
-            compute_type="int8_float16",
-            tokenizer=AutoTokenizer.from_pretrained(model_dir),
-        )
-        translated_text = model.generate(text=text)
-        return translated_text
+M2M_MODEL = "michaelfeil/ct2fast-m2m100_1.2B"
+M2M_TOKENIZER = "facebook/m2m100_1.2B"
 
-    if f"{source_lang}-{target_lang}" in ["en-ko", "en-th", "en-ja"]:
-        translated_text = translate_text(text, source_lang, target_lang)
-        return translated_text
+def load_model(direction, model_path):
+    if direction == "m2m":
+        return load_backend(direction, model_path, tokenizer_name=M2M_TOKENIZER, multilingual=True)
+    return load_backend(direction, model_path)
 
-    if f"{source_lang}-{target_lang}" in direct_model_mapping:
-        translated_text = perform_translation(
-            text, direct_model_mapping[f"{source_lang}-{target_lang}"]
-        )
-    elif source_lang in supported_langs and target_lang in supported_langs:
-        intermediate_text = perform_translation(
-            text, direct_model_mapping[f"{source_lang}-en"]
-        )
-        final_text = perform_translation(
-            intermediate_text, direct_model_mapping[f"en-{target_lang}"]
+# Models, m2m100 included, load on first use or in the background warm-up
+model_registry = ModelRegistry({**direct_model_mapping, "m2m": M2M_MODEL}, loader=load_model)
+model_registry.warm_in_background(parse_warm_models(WARM_MODELS, model_registry.model_mapping))
+
+# Token budget per chunk, measured with the first model's tokenizer
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+
+def resolve_route(source_lang, target_lang):
+    direction = f"{source_lang}-{target_lang}"
+    if direction in ["en-ko", "en-th", "en-ja"]:
+        return [("m2m", source_lang, target_lang)]
+    if direction in direct_model_mapping:
+        return [(direction, source_lang, target_lang)]
+    if source_lang in supported_langs and target_lang in supported_langs:
+        return [(f"{source_lang}-en", source_lang, "en"), (f"en-{target_lang}", "en", target_lang)]
+    return [("m2m", source_lang, target_lang)]
+
+def route_model_id(route):
+    return "+".join(model_names.get(model_key, model_name) for model_key, _, _ in route)
+
+def source_tokenizer(source_lang, target_lang):
+    # The chunker's token ids are only reusable by the first model on the route
+    model_key = resolve_route(source_lang, target_lang)[0][0]
+    return model_registry.get(model_key).tokenizer
+
+translation_memory = TranslationMemory()
+
+# Shared with api.py, which attaches repeat uploads of a book to its job
+job_store = JobStore()
+
+def translate_chunk_batch(texts, batch_ids, source_lang, target_lang):
+    # One batched generate call for a bucket of chunks; cached chunks skip the model
+    route = resolve_route(source_lang, target_lang)
+    model_id = route_model_id(route)
+    results = [translation_memory.get(text, source_lang, target_lang, model_id) for text in texts]
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    if not misses:
+        return results
+
+    miss_texts = [texts[i] for i in misses]
+    miss_ids = [batch_ids[i] for i in misses]
+    model_key = route[0][0]
+    if model_key == "m2m":
+        translated = model_registry.get("m2m").generate(
+            miss_texts, src_lang=[source_lang] * len(misses), tgt_lang=[target_lang] * len(misses)
         )
-        translated_text = final_text
+    elif len(route) == 1:
+        translated = translate_ids_batch(model_registry.get(model_key), miss_ids)
     else:
-        translated_text = translate_text(text, source_lang, target_lang)
-    return translated_text
-
-def remove_line(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    processed_lines = []
-    for i in range(len(lines)):
-        if lines[i].strip() == "":
-            processed_lines.append(lines[i])
-        else:
-            if i + 1 < len(lines) and lines[i + 1].strip() == "":
-                processed_lines.append(lines[i])
-            else:
-                processed_lines.append(lines[i].rstrip() + " ")
-
-    # Join the processed lines into a single string
-    processed_content = "".join(processed_lines)
-
-    # Write the processed content back to the file
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.write(processed_content)
-
-def process_file(s3_bucket, s3_key, source_lang, target_lang, unique_id, recipient_email):
-    # Download the file from S3
-    local_file_path = f"/tmp/{s3_key.split('/')[-1]}"
-    s3.download_file(s3_bucket, s3_key, local_file_path)
-
-    remove_line(local_file_path)
-
-    # Read the file content
-    with open(local_file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    # Split lines into chunks and store their original positions
-    line_chunks = []
-    line_positions = []
-    for i, line in enumerate(lines):
-        if not line.strip():
-            line_chunks.append(("\n", i))
-        else:
-            chunks = split_text(line, 400, tokenizer)
-            for chunk in chunks:
-                line_chunks.append((chunk, i))
-    
-    # Translate chunks and store results in the correct position
-    translated_lines = [""] * len(lines)
-
-    def translate_chunk(chunk, pos):
-        translated_chunk = translate_with_timing(chunk, source_lang, target_lang) + "\n"
-        return translated_chunk, pos
-
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        future_to_position = {executor.submit(translate_chunk, chunk, pos): pos for chunk, pos in line_chunks}
-        for future in future_to_position:
-            translated_chunk, pos = future.result()
-            if translated_lines[pos] == "":
-                translated_lines[pos] = translated_chunk
-            else:
-                translated_lines[pos] += translated_chunk
-
-    # Combine translated lines into content
-    translated_content = "".join(translated_lines)
-
-    # Save the translated content to a new file
+        translated, _ = translate_pivot_batch(
+            miss_texts,
+            model_registry.get(route[0][0]),
+            model_registry.get(route[1][0]),
+            source_ids=miss_ids,
+        )
+
+    for i, translated_text in zip(misses, translated):
+        results[i] = translated_text
+        translation_memory.put(texts[i], source_lang, target_lang, model_id, translated_text)
+    return results
+
+# Books running side by side share the model: batches are interleaved by
+# priority tier and fair share per recipient, and topped up across jobs
+job_scheduler = FairScheduler(
+    lambda key, texts, batch_ids: translate_chunk_batch(texts, batch_ids, *key)
+)
+QUEUE_DEPTH.set_function(job_scheduler.queue_depth, queue="book")
+JOB_DEFER_SECONDS = int(os.getenv("JOB_DEFER_SECONDS", "60"))
+
+def job_owner(recipient_email, unique_id):
+    # Fair share and the per-owner job limit are per address; anonymous
+    # uploads are each their own owner instead of one shared one
+    return recipient_email or f"job:{unique_id}"
+
+def process_file(s3_bucket, s3_key, source_lang, target_lang, unique_id, recipient_email, priority="normal"):
+    if not job_store.start(unique_id, s3_bucket, s3_key, source_lang, target_lang, recipient_email, priority):
+        print(f"Skipping {unique_id}: it is already done or a newer job has the book")
+        return
+    chunk_tokenizer = source_tokenizer(source_lang, target_lang)
+    owner = job_owner(recipient_email, unique_id)
+
+    def chunk_line(line):
+        return chunk_text(line, chunk_tokenizer, CHUNK_MAX_TOKENS, source_lang)
+
+    def translate_batch(texts, batch_ids):
+        translated = job_scheduler.translate(owner, tier, (source_lang, target_lang), texts, batch_ids)
+        progress.translated(len(texts), sum(len(ids) if ids is not None else len(text.split()) for text, ids in zip(texts, batch_ids)))
+        return translated
+
+    # Completed chunks are journaled so a restarted job only redoes the rest
+    journal_path = os.path.join(CHECKPOINT_DIR, f"{unique_id}.db")
+    journal_sync = S3JournalSync(s3, s3_bucket, unique_id) if CHECKPOINT_S3 else None
+    if journal_sync is not None and not os.path.exists(journal_path):
+        journal_sync.download(journal_path)
+    fingerprint = f"{source_lang}-{target_lang}:{route_model_id(resolve_route(source_lang, target_lang))}:{CHUNK_MAX_TOKENS}"
+    journal = ChunkJournal(journal_path, fingerprint)
+    if journal.count():
+        print(f"Found {journal.count()} translated chunks for {unique_id}")
+
+    def on_window(chunks):
+        progress.window_done(chunks, src.buffer.tell())
+        if journal_sync is not None:
+            journal_sync.upload(journal_path)
+
+    # Repeated chunks (chapter headings, separators, dialogue) are translated once per book
+    dedup = ChunkDedup()
+
+    # Stream the book through in bounded windows: lines are read and joined
+    # lazily, each window of chunks is translated in length buckets, and its
+    # lines go straight into a multipart upload of the result before the next
+    # window is read. Nothing is written to /tmp.
+    # Blank lines are kept as they are and never reach the model.
     translated_file_name = f"{s3_key.rsplit('.', 1)[0]}_{unique_id}_translated.txt"
-    translated_file_path = f"/tmp/{translated_file_name}"
-    with open(translated_file_path, 'w', encoding='utf-8') as file:
-        file.write(translated_content)
+    try:
+        with read_text_object(s3_bucket, s3_key) as src:
+            # Small books move up a tier so they do not wait behind long ones
+            book_bytes = src.buffer.seek(0, io.SEEK_END)
+            src.buffer.seek(0)
+            tier = job_priority(priority, book_bytes)
+            # Progress for GET /jobs/<id>, written every JOB_PROGRESS_SECONDS
+            progress = JobProgress(job_store, unique_id, book_bytes)
+            translated_lines = translate_book_stream(
+                iter_book_lines(src), chunk_line, translate_batch, journal=journal, on_window=on_window, dedup=dedup
+            )
+            download_url = upload_stream_to_s3(LineStream(translated_lines), s3_bucket, translated_file_name)
+    finally:
+        journal.close()
+    print(f"Translated {dedup.translated} of {dedup.total} chunks for {unique_id} (dedup ratio {dedup.ratio():.1%})")
 
-    # Upload the translated file back to S3
-    presigned_url = upload_file_to_s3(translated_file_path, s3_bucket, translated_file_name)
+    if download_url is None:
+        # Keep the checkpoint so a retry does not translate the book again
+        if journal_sync is not None:
+            journal_sync.upload(journal_path, force=True)
+        raise RuntimeError(f"Failed to upload {translated_file_name}")
+
+    os.remove(journal_path)
+    if journal_sync is not None:
+        journal_sync.delete()
+
+    # Later uploads of the same book get this result; uploads that arrived
+    # while it was running were attached to this job and get the email too
+    progress.write(finished=True)
+    job_store.set_state(unique_id, DONE, result_key=translated_file_name)
+    recipients = [e for e in [recipient_email] + job_store.recipients(unique_id) if e]
+    recipients = list(dict.fromkeys(recipients))
 
     # Send email notification with the download link
     email_subject = "Your book is ready!"
-    email_body = f"Your processed book is ready. You can download it from: {presigned_url} within 7 days"
-    send_secure_email(email_subject, email_body, recipient_email, EMAIL, EMAIL_PASSWORD)
-    print(f"Email sent to {recipient_email}")
-
-def upload_file_to_s3(file_name, bucket_name, object_name=None):
-    if object_name is None:
-        object_name = file_name
-    s3_client = boto3.client('s3')
+    email_body = f"Your processed book is ready. You can download it from: {download_url} within 7 days"
+    for email in recipients:
+        send_secure_email(email_subject, email_body, email, EMAIL, EMAIL_PASSWORD)
+        print(f"Email sent to {email}")
+
+def upload_stream_to_s3(stream, bucket_name, object_name):
+    # Multipart upload through the shared client; the URL expires in 7 days
     try:
-        s3_client.upload_file(file_name, bucket_name, object_name)
-        # Generate a presigned URL for the uploaded file
-        presigned_url = s3_client.generate_presigned_url('get_object',
-                                                         Params={'Bucket': bucket_name,
-                                                                 'Key': object_name},
-                                                         ExpiresIn=3600*24*7) # URL expires in 7 days
-        return presigned_url
-    except Exception:
-        print("Credentials not available")
+        upload_stream(stream, bucket_name, object_name)
+        return presigned_url(bucket_name, object_name)
+    except Exception as e:
+        # A translation error raised while the stream was read is not an upload failure
+        if getattr(stream, "error", None) is not None:
+            raise stream.error
+        print(f"Error uploading {object_name} to S3: {e}")
         return None
 
+def is_permanent_error(e):
+    """The uploaded book is gone or is not UTF-8 text."""
+    if isinstance(e, (FileNotFoundError, UnicodeDecodeError)):
+        return True
+    response = getattr(e, 'response', None)
+    if not isinstance(response, dict):
+        return False
+    return response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NoSuchBucket')
+
+def process_message(message_body):
+    try:
+        s3_bucket = message_body['s3_bucket']
+        s3_key = message_body['s3_key']
+        source_lang = message_body['source_lang']
+        target_lang = message_body['target_lang']
+        unique_id = message_body['unique_id']
+        recipient_email = message_body['recipient_email']
+    except (KeyError, TypeError) as e:
+        give_up_job(message_body, f"Invalid message: {e!r}")
+        raise InvalidMessage(repr(e))
+    priority = message_body.get('priority', 'normal')
+    # A bulk run from one address must not take every worker; its other
+    # books go back on the queue until one of its running books finishes
+    owner = job_owner(recipient_email, unique_id)
+    if not job_scheduler.admit(owner):
+        raise Deferred(f"{owner} already has books running", JOB_DEFER_SECONDS)
+    try:
+        print("Reading queue. Found translation task " + s3_key)
+        # Keeps the job from expiring while it waits for batches, like the
+        # consumer's heartbeat keeps its message
+        with JobLease(job_store, unique_id):
+            process_file(s3_bucket, s3_key, source_lang, target_lang, unique_id, recipient_email, priority)
+    except Exception as e:
+        if is_permanent_error(e):
+            # No redelivery can fix it; fail the job and drop the message
+            job_store.set_state(unique_id, FAILED, error=str(e))
+            raise InvalidMessage(str(e))
+        # SQS delivers the message again, so the job goes back to queued
+        job_store.set_state(unique_id, QUEUED, error=str(e))
+        raise
+    finally:
+        job_scheduler.release(owner)
+
+def give_up_job(message_body, error):
+    # The message is dead-lettered or dropped, so its job can never finish; mark
+    # it failed so it leaves the in-flight index and a new upload can queue the book
+    unique_id = message_body.get('unique_id') if isinstance(message_body, dict) else None
+    if unique_id:
+        job_store.set_state(unique_id, FAILED, error=str(error))
+
 def process_sqs_message():
-    while True:
-        try:
-            time.sleep(2)
-            message_body = read_message_from_sqs()
-            if message_body:
-                s3_bucket = message_body['s3_bucket']
-                s3_key = message_body['s3_key']
-                source_lang = message_body['source_lang']
-                target_lang = message_body['target_lang']
-                unique_id = message_body['unique_id']
-                recipient_email = message_body['recipient_email']
-                print("Reading queue. Found translation task " + s3_key)
-                process_file(s3_bucket, s3_key, source_lang, target_lang, unique_id, recipient_email)
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-# Function to read message from SQS
-def read_message_from_sqs():
-    response = sqs.receive_message(
-        QueueUrl=SQS_QUEUE_URL,
-        AttributeNames=['All'],
-        MaxNumberOfMessages=1,
-        MessageAttributeNames=['All'],
-        VisibilityTimeout=30,
-        WaitTimeSeconds=0
-    )
-
-    if 'Messages' in response:
-        for message in response['Messages']:
-            body = message['Body']
-            receipt_handle = message['ReceiptHandle']
-            sqs.delete_message(QueueUrl=SQS_QUEUE_URL, ReceiptHandle=receipt_handle)
-            return json.loads(body)
-    return None
+    # Long-poll the queue; a message is deleted only after its book is uploaded
+    consumer = SQSConsumer(sqs, SQS_QUEUE_URL, process_message, on_give_up=give_up_job)
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    consumer.run_forever()
 
 # Start the conversion service
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+from concurrent.futures import Future
+
+from book_engine import BOOK_BATCH_MAX_SIZE, BOOK_BATCH_TOKENS
+
+# Generate calls that run at the same time (one per GPU is usually right)
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", "1"))
+# A waiting batch moves up one priority tier every this many seconds
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "600"))
+# Books one recipient may have running at once; more are put back on the queue
+JOBS_PER_OWNER = int(os.getenv("JOBS_PER_OWNER", "2"))
+# Books smaller than this move up one priority tier
+SMALL_JOB_BYTES = int(os.getenv("SMALL_JOB_BYTES", "200000"))
+
+PRIORITY_TIERS = {"high": 0, "normal": 1, "bulk": 2}
+
+
+def job_priority(name, size_bytes=None):
+    """Priority tier (lower runs first) for a priority name and book size."""
+    tier = PRIORITY_TIERS.get(name, PRIORITY_TIERS["normal"])
+    if size_bytes is not None and size_bytes < SMALL_JOB_BYTES:
+        tier = max(0, tier - 1)
+    return tier
+
+
+class _Request:
+    def __init__(self, owner, priority, key, texts, batch_ids):
+        self.owner = owner
+        self.priority = priority
+        self.key = key
+        self.texts = texts
+        self.batch_ids = batch_ids
+        lengths = [
+            len(ids) if ids is not None else len(text.split())
+            for text, ids in zip(texts, batch_ids)
+        ]
+        self.longest = max(lengths, default=1)
+        self.cost = sum(lengths)
+        self.created = time.monotonic()
+        self.future = Future()
+
+
+class FairScheduler:
+    """Shares the model between book jobs by priority tier and fair share per owner.
+
+    Jobs submit length-bucketed batches of chunks. The next batch to run is
+    the one with the best priority tier (which improves while it waits),
+    then the owner that has been served the fewest tokens. That batch is then
+    topped up with waiting chunks of other jobs on the same language pair,
+    so generate calls stay full however many jobs are active.
+    `run_batch(key, texts, batch_ids)` must return one result per text.
+    """
+
+    def __init__(
+        self,
+        run_batch,
+        slots=SCHEDULER_SLOTS,
+        max_batch_size=BOOK_BATCH_MAX_SIZE,
+        max_batch_tokens=BOOK_BATCH_TOKENS,
+        aging_seconds=PRIORITY_AGING_SECONDS,
+        jobs_per_owner=JOBS_PER_OWNER,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.aging_seconds = aging_seconds
+        self.jobs_per_owner = jobs_per_owner
+        self._pending = []
+        # Tokens served per owner; an owner that comes back starts at the clock
+        self._served = {}
+        self._clock = 0
+        self._active_jobs = {}
+        self._condition = threading.Condition()
+        for _ in range(max(1, slots)):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def admit(self, owner):
+        """Reserve a job slot for `owner`; False when they already have jobs_per_owner running."""
+        with self._condition:
+            if self._active_jobs.get(owner, 0) >= self.jobs_per_owner:
+                return False
+            self._active_jobs[owner] = self._active_jobs.get(owner, 0) + 1
+            return True
+
+    def release(self, owner):
+        with self._condition:
+            self._active_jobs[owner] -= 1
+            if not self._active_jobs[owner]:
+                del self._active_jobs[owner]
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._pending)
+
+    def submit(self, owner, priority, key, texts, batch_ids):
+        """Queue one batch of a job and return a Future for its translations."""
+        request = _Request(owner, priority, key, list(texts), list(batch_ids))
+        with self._condition:
+            if not any(r.owner == owner for r in self._pending):
+                self._served[owner] = max(self._served.get(owner, 0), self._clock)
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def translate(self, owner, priority, key, texts, batch_ids):
+        return self.submit(owner, priority, key, texts, batch_ids).result()
+
+    def _rank(self, request, now):
+        waited_tiers = int((now - request.created) // self.aging_seconds) if self.aging_seconds > 0 else 0
+        return (
+            max(0, request.priority - waited_tiers),
+            self._served[request.owner],
+            request.created,
+        )
+
+    def _next_batch(self):
+        # Caller must hold self._condition
+        now = time.monotonic()
+        ranked = sorted(self._pending, key=lambda r: self._rank(r, now))
+        first = ranked[0]
+        batch = [first]
+        size = len(first.texts)
+        longest = first.longest
+        for request in ranked[1:]:
+            if request.key != first.key:
+                continue
+            new_size = size + len(request.texts)
+            new_longest = max(longest, request.longest)
+            if new_size <= self.max_batch_size and new_longest * new_size <= self.max_batch_tokens:
+                batch.append(request)
+                size = new_size
+                longest = new_longest
+
+        self._clock = self._served[first.owner]
+        for request in batch:
+            self._pending.remove(request)
+            self._served[request.owner] += request.cost
+        # Forget owners that are idle and not ahead of the clock
+        waiting = {r.owner for r in self._pending}
+        for owner in [o for o, served in self._served.items() if o not in waiting and served <= self._clock]:
+            del self._served[owner]
+        return batch
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                batch = self._next_batch()
+
+            texts = [text for request in batch for text in request.texts]
+            batch_ids = [ids for request in batch for ids in request.batch_ids]
+            try:
+                results = self.run_batch(batch[0].key, texts, batch_ids)
+                if len(results) != len(texts):
+                    raise RuntimeError(
+                        f"Batch for {batch[0].key} returned {len(results)} results for {len(texts)} inputs"
+                    )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            start = 0
+            for request in batch:
+                request.future.set_result(results[start : start + len(request.texts)])
+                start += len(request.texts)
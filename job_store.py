@@ -0,0 +1,355 @@
+"""
+Local job store shared by the upload API and the conversion worker.
+
+Books are keyed by content: a hash of the text plus the language pair and the
+model version. A repeated upload reuses the finished translation, and an
+upload of a book that is already queued or running is attached to that job
+instead of being translated again.
+
+The worker also records each job's progress here (chunks, tokens per second,
+ETA) for the /jobs endpoints in api.py.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+# Bump when model weights change without a change to model_names.cfg
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+# How often a running job writes its progress
+JOB_PROGRESS_SECONDS = float(os.getenv("JOB_PROGRESS_SECONDS", "5"))
+# A running job whose lease has not been renewed for this long is presumed dead
+JOB_RUNNING_LEASE_SECONDS = float(os.getenv("JOB_RUNNING_LEASE_SECONDS", "1800"))
+# How often a running job renews its lease, whether or not batches are coming back
+JOB_LEASE_RENEW_SECONDS = float(os.getenv("JOB_LEASE_RENEW_SECONDS", "60"))
+# A queued job older than this has outlived its message (SQS keeps messages 4 days by default)
+JOB_QUEUED_LEASE_SECONDS = float(os.getenv("JOB_QUEUED_LEASE_SECONDS", str(4 * 24 * 3600)))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Columns added after the first release, created on existing stores at startup
+PROGRESS_COLUMNS = {
+    "recipient_email": "TEXT",
+    "priority": "TEXT",
+    "started": "REAL",
+    "chunks_done": "INTEGER DEFAULT 0",
+    "chunks_total": "INTEGER",
+    "tokens_done": "INTEGER DEFAULT 0",
+    "tokens_per_second": "REAL",
+    "eta_seconds": "REAL",
+    "error": "TEXT",
+}
+# Returned by the API; content keys and addresses stay internal
+PUBLIC_COLUMNS = [
+    "unique_id", "state", "source_lang", "target_lang", "priority", "created", "started",
+    "updated", "chunks_done", "chunks_total", "tokens_done", "tokens_per_second", "eta_seconds", "error",
+]
+
+_model_version = None
+
+
+def model_version(config_path="model_names.cfg"):
+    """Short hash of the model list and MODEL_VERSION; results from other models are not reused."""
+    global _model_version
+    if _model_version is None:
+        digest = hashlib.sha256(MODEL_VERSION.encode("utf-8"))
+        if os.path.exists(config_path):
+            with open(config_path, "rb") as f:
+                digest.update(f.read())
+        _model_version = digest.hexdigest()[:16]
+    return _model_version
+
+
+def content_key(fileobj, source_lang, target_lang, chunk_size=1024 * 1024):
+    """Key of the book read from a binary file object, hashed a chunk at a time."""
+    # Line endings differ between mirrors of the same book
+    digest = hashlib.sha256()
+    carry = b""
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        chunk = carry + chunk
+        # A "\r\n" split across two reads is still one line ending
+        carry = b"\r" if chunk.endswith(b"\r") else b""
+        digest.update(chunk[: len(chunk) - len(carry)].replace(b"\r\n", b"\n"))
+    digest.update(carry)
+    return f"{digest.hexdigest()}:{source_lang}-{target_lang}:{model_version()}"
+
+
+class JobStore:
+    """sqlite table of book jobs and the addresses waiting for each one."""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # The API and the worker write to the same file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "unique_id TEXT PRIMARY KEY, content_key TEXT, state TEXT, "
+                "s3_bucket TEXT, s3_key TEXT, result_key TEXT, "
+                "source_lang TEXT, target_lang TEXT, created REAL, updated REAL)"
+            )
+            # At most one queued or running job per book
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (content_key) "
+                "WHERE state IN ('queued', 'running')"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_content ON jobs (content_key, state)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_recipients ("
+                "unique_id TEXT, email TEXT, PRIMARY KEY (unique_id, email))"
+            )
+            existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in PROGRESS_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)"
+            )
+
+    def _expire_stale(self):
+        # Caller must hold self._lock inside a transaction. Jobs whose worker or
+        # message is gone leave the in-flight index so the book can be queued again
+        now = time.time()
+        self._conn.execute(
+            "UPDATE jobs SET state = ?, error = COALESCE(error, 'Lease expired'), updated = ? "
+            "WHERE (state = ? AND updated < ?) OR (state = ? AND updated < ?)",
+            (FAILED, now, RUNNING, now - JOB_RUNNING_LEASE_SECONDS, QUEUED, now - JOB_QUEUED_LEASE_SECONDS),
+        )
+
+    def expire_stale(self):
+        with self._lock, self._conn:
+            self._expire_stale()
+
+    def find_done(self, key):
+        """The latest finished job for a content key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE content_key = ? AND state = ? "
+                "ORDER BY updated DESC LIMIT 1",
+                (key, DONE),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def create_or_attach(self, unique_id, key, s3_bucket, s3_key, source_lang, target_lang, recipient_email, priority="normal"):
+        """Create a queued job, or attach the recipient to the job already in flight for `key`.
+
+        Returns (unique_id, created). When `created` is False the returned id
+        is the existing job's and nothing should be enqueued.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._expire_stale()
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (unique_id, content_key, state, s3_bucket, s3_key, source_lang, "
+                    "target_lang, recipient_email, priority, created, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (unique_id, key, QUEUED, s3_bucket, s3_key, source_lang, target_lang,
+                     recipient_email, priority, now, now),
+                )
+                created = True
+            except sqlite3.IntegrityError:
+                unique_id = self._conn.execute(
+                    "SELECT unique_id FROM jobs WHERE content_key = ? AND state IN (?, ?)",
+                    (key, QUEUED, RUNNING),
+                ).fetchone()["unique_id"]
+                created = False
+            if recipient_email:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO job_recipients (unique_id, email) VALUES (?, ?)",
+                    (unique_id, recipient_email),
+                )
+        return unique_id, created
+
+    def set_state(self, unique_id, state, result_key=None, error=None):
+        with self._lock, self._conn:
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, result_key = COALESCE(?, result_key), error = ?, "
+                    "updated = ? WHERE unique_id = ?",
+                    (state, result_key, error, time.time(), unique_id),
+                )
+            except sqlite3.IntegrityError:
+                # Putting an expired job back in flight while a newer job for the
+                # same book runs; the newer job carries the book from here
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE unique_id = ?",
+                    (FAILED, error or "Superseded by a newer job", time.time(), unique_id),
+                )
+
+    def start(self, unique_id, s3_bucket, s3_key, source_lang, target_lang, recipient_email, priority="normal"):
+        """Mark a job running, adding it if it was queued without the API (e.g. an older message).
+
+        Returns False when the job must not run: it is already done (a
+        duplicate delivery) or it expired and a newer job for the same book
+        is in flight.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (unique_id, state, s3_bucket, s3_key, source_lang, "
+                "target_lang, recipient_email, priority, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (unique_id, QUEUED, s3_bucket, s3_key, source_lang, target_lang,
+                 recipient_email, priority, now, now),
+            )
+            state = self._conn.execute(
+                "SELECT state FROM jobs WHERE unique_id = ?", (unique_id,)
+            ).fetchone()["state"]
+            if state == DONE:
+                return False
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, started = ?, updated = ?, error = NULL, "
+                    "eta_seconds = NULL WHERE unique_id = ?",
+                    (RUNNING, now, now, unique_id),
+                )
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def renew(self, unique_id):
+        """Push a running job's lease forward; no effect once it has finished or expired."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET updated = ? WHERE unique_id = ? AND state = ?",
+                (time.time(), unique_id, RUNNING),
+            )
+
+    def update_progress(self, unique_id, chunks_done, chunks_total, tokens_done, tokens_per_second, eta_seconds):
+        """Record progress; the worker calls this every few seconds, not once per chunk."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET chunks_done = ?, chunks_total = ?, tokens_done = ?, "
+                "tokens_per_second = ?, eta_seconds = ?, updated = ? WHERE unique_id = ?",
+                (chunks_done, chunks_total, tokens_done, tokens_per_second, eta_seconds,
+                 time.time(), unique_id),
+            )
+
+    def list_jobs(self, state=None, limit=50, offset=0):
+        """Newest jobs first, optionally for one state."""
+        where = "WHERE state = ? " if state else ""
+        params = [state] if state else []
+        with self._lock, self._conn:
+            # Stuck jobs are reported as failed, not as queued forever
+            self._expire_stale()
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs {where}ORDER BY created DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        """Number of jobs in each state."""
+        with self._lock, self._conn:
+            self._expire_stale()
+            rows = self._conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def recipients(self, unique_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT email FROM job_recipients WHERE unique_id = ?", (unique_id,)
+            ).fetchall()
+        return [row["email"] for row in rows]
+
+    def get(self, unique_id):
+        with self._lock, self._conn:
+            self._expire_stale()
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE unique_id = ?", (unique_id,)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+
+class JobLease:
+    """Renews a job's lease every `interval` seconds from a daemon thread while in use.
+
+    A job waiting behind higher tiers or for a model download writes no
+    progress but is still alive.
+    """
+
+    def __init__(self, store, unique_id, interval=JOB_LEASE_RENEW_SECONDS):
+        self.store = store
+        self.unique_id = unique_id
+        self.interval = interval
+        self._done = threading.Event()
+
+    def __enter__(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            try:
+                self.store.renew(self.unique_id)
+            except Exception as e:
+                print(f"Failed to renew the lease of job {self.unique_id}: {e}")
+
+
+class JobProgress:
+    """Counts a running job's work and writes it to the store every `interval` seconds.
+
+    The hot loop only adds to counters; chunks_total and the ETA are
+    estimated from how much of the book (in bytes) the finished windows cover.
+    """
+
+    def __init__(self, store, unique_id, bytes_total, interval=JOB_PROGRESS_SECONDS):
+        self.store = store
+        self.unique_id = unique_id
+        self.bytes_total = bytes_total
+        self.interval = interval
+        self.chunks_done = 0
+        self.tokens_done = 0
+        self._window_chunks = 0
+        self._bytes_done = 0
+        self._started = time.monotonic()
+        self._last_write = self._started
+
+    def translated(self, chunks, tokens):
+        """A batch of chunks came back from the model."""
+        self._window_chunks += chunks
+        self.tokens_done += tokens
+        self._maybe_write()
+
+    def window_done(self, chunks, bytes_done):
+        """A window of `chunks` chunks is finished and the book has been read up to `bytes_done`."""
+        self.chunks_done += chunks
+        self._window_chunks = 0
+        self._bytes_done = bytes_done
+        self._maybe_write()
+
+    def _maybe_write(self):
+        if time.monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self, finished=False):
+        now = time.monotonic()
+        self._last_write = now
+        elapsed = max(now - self._started, 1e-6)
+        chunks_done = self.chunks_done + self._window_chunks
+        fraction = min(1.0, self._bytes_done / self.bytes_total) if self.bytes_total else 0.0
+        if finished:
+            chunks_total, eta_seconds = chunks_done, 0.0
+        elif fraction > 0 and self.chunks_done:
+            chunks_total = max(chunks_done, round(self.chunks_done / fraction))
+            eta_seconds = elapsed * (1 - fraction) / fraction
+        else:
+            chunks_total, eta_seconds = None, None
+        self.store.update_progress(
+            self.unique_id, chunks_done, chunks_total, self.tokens_done,
+            self.tokens_done / elapsed, eta_seconds,
+        )
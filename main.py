@@ -1,11 +1,19 @@
 import os
 import time
-from transformers import AutoTokenizer
-from flask import Flask, request, jsonify
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from hf_hub_ctranslate2 import MultiLingualTranslatorCT2fromHfHub
 from dotenv import load_dotenv
-from hf_hub_ctranslate2 import TranslatorCT2fromHfHub
+from backends import load_backend
+from model_registry import ModelRegistry, WARM_MODELS, parse_warm_models
+from batching import BatchScheduler
+from translation_memory import TranslationMemory
+from pivot import translate_pivot_batch
+from chunker import split_sentences
+from metrics import CONTENT_TYPE, QUEUE_DEPTH, REGISTRY
+import queue
 
 load_dotenv()
 
@@ -14,6 +22,8 @@ HF_TOKEN = os.getenv("HF_TOKEN_READ")
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+MAX_REQUEST_MB = int(os.getenv("MAX_REQUEST_MB", "4"))
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_MB * 1024 * 1024
 
 
 def load_model_names(file_path):
@@ -33,37 +43,92 @@ direct_model_mapping = {
     k: f"{weights_relative_path}/ct2fast-{v}" for k, v in model_names.items()
 }
 
+# Limits for /translate/batch
+BATCH_MAX_SEGMENTS = int(os.getenv("BATCH_MAX_SEGMENTS", "512"))
+BATCH_MAX_TOKENS = int(os.getenv("BATCH_MAX_TOKENS", "16384"))
+# Checked without a tokenizer; text without spaces (zh, ja, th) gives no
+# useful whitespace estimate of its tokens
+BATCH_MAX_SEGMENT_CHARS = int(os.getenv("BATCH_MAX_SEGMENT_CHARS", "4096"))
+BATCH_MAX_CHARS = int(os.getenv("BATCH_MAX_CHARS", "65536"))
+
+# /translate/stream sends this many sentences per generate call and keeps up
+# to STREAM_PIPELINE_DEPTH calls in flight while earlier results are sent
+STREAM_BATCH_SENTENCES = int(os.getenv("STREAM_BATCH_SENTENCES", "8"))
+STREAM_PIPELINE_DEPTH = int(os.getenv("STREAM_PIPELINE_DEPTH", "2"))
+stream_executor = ThreadPoolExecutor(max_workers=int(os.getenv("STREAM_WORKERS", "8")))
+
 # Supported languages for intermediate translation
 supported_langs = ["en", "es", "fr", "de", "zh", "vi", "ko", "th", "ja"]
 
 model_name = "michaelfeil_ct2fast-m2m100_1.2B"
-model_dir = os.path.join(weights_relative_path, model_name)
-os.makedirs(model_dir, exist_ok=True)
-
-# Initialize the model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained("facebook/m2m100_1.2B")
-model_m2m = MultiLingualTranslatorCT2fromHfHub(
-    model_name_or_path="michaelfeil/ct2fast-m2m100_1.2B",
-    device="cuda",
-    compute_type="int8_float16",
-    tokenizer=tokenizer,
+M2M_MODEL = "michaelfeil/ct2fast-m2m100_1.2B"
+M2M_TOKENIZER = "facebook/m2m100_1.2B"
+# Language codes m2m100 translates between; every other pair is rejected
+M2M_LANGS = set(
+    "af am ar ast az ba be bg bn br bs ca ceb cs cy da de el en es et fa ff fi fr fy "
+    "ga gd gl gu ha he hi hr ht hu hy id ig ilo is it ja jv ka kk km kn ko lb lg ln "
+    "lo lt lv mg mk ml mn mr ms my ne nl no ns oc or pa pl ps pt ro ru sd si sk sl so "
+    "sq sr ss su sv sw ta th tl tn tr uk ur uz vi wo xh yi yo zh zu".split()
 )
 
-tokenizer.save_pretrained(model_dir)
 
-if hasattr(model_m2m, "save_pretrained"):
-    model_m2m.save_pretrained(model_dir)
-else:
-    print(
-        "The model does not support the 'save_pretrained' method. Please implement a custom saving mechanism."
-    )
+class UnsupportedLanguage(ValueError):
+    pass
+
+
+def check_langs(source_lang, target_lang):
+    """Raise UnsupportedLanguage unless some model translates source_lang to target_lang.
+
+    Checked before anything is queued, so unknown pairs never get a batching key.
+    """
+    for lang in (source_lang, target_lang):
+        if not isinstance(lang, str) or lang not in M2M_LANGS:
+            raise UnsupportedLanguage(f"Unsupported language: {lang}")
+
+
+def load_model(direction, model_path):
+    if direction == "m2m":
+        return load_backend(
+            direction, model_path, tokenizer_name=M2M_TOKENIZER, multilingual=True
+        )
+    return load_backend(direction, model_path)
+
+
+# All models, m2m100 included, are loaded on first use or by the background
+# warm-up and then shared by all request threads. Nothing is loaded at import,
+# so the server answers health checks and /supported_langs right away.
+model_registry = ModelRegistry({**direct_model_mapping, "m2m": M2M_MODEL}, loader=load_model)
+warm_directions = parse_warm_models(WARM_MODELS, model_registry.model_mapping)
+warm_thread = model_registry.warm_in_background(warm_directions)
+
+
+def run_translation_batch(key, texts):
+    model_key, src_lang, tgt_lang = key
+    if model_key == "m2m":
+        return model_registry.get("m2m").generate(
+            texts, src_lang=[src_lang] * len(texts), tgt_lang=[tgt_lang] * len(texts)
+        )
+    if model_key == "pivot":
+        translated, timings = translate_pivot_batch(
+            texts,
+            model_registry.get(f"{src_lang}-en"),
+            model_registry.get(f"en-{tgt_lang}"),
+        )
+        print(
+            f"2-step translation time ({src_lang}-en-{tgt_lang}, batch {len(texts)}): "
+            f"{timings['first_leg']:.4f} + {timings['second_leg']:.4f} seconds"
+        )
+        return translated
+    return model_registry.get(model_key).generate(text=texts)
+
 
-print(f"Model and tokenizer have been saved to '{model_dir}'")
+# Concurrent requests for the same (model, src, tgt) share one generate call
+batch_scheduler = BatchScheduler(run_translation_batch)
+QUEUE_DEPTH.set_function(batch_scheduler.queue_depth, queue="batch")
 
 
 def translate_text(sentences, src_lang, tgt_lang):
-    outputs = model_m2m.generate([sentences], src_lang=[src_lang], tgt_lang=[tgt_lang])
-    return outputs[0]
+    return batch_scheduler.translate(("m2m", src_lang, tgt_lang), sentences)
 
 
 def remove_prompt_from_translation(translated_text):
@@ -74,16 +139,45 @@ def remove_prompt_from_translation(translated_text):
         return translated_text
 
 
+def resolve_route(source_lang, target_lang):
+    """Return the (model, src, tgt) legs used to translate between two languages."""
+    check_langs(source_lang, target_lang)
+    direction = f"{source_lang}-{target_lang}"
+    if direction in ["en-ko", "en-th", "en-ja"]:
+        return [("m2m", source_lang, target_lang)]
+    if direction in direct_model_mapping:
+        return [(direction, source_lang, target_lang)]
+    if source_lang in supported_langs and target_lang in supported_langs:
+        return [
+            (f"{source_lang}-en", source_lang, "en"),
+            (f"en-{target_lang}", "en", target_lang),
+        ]
+    return [("m2m", source_lang, target_lang)]
+
+
+def route_model_id(route):
+    return "+".join(model_names.get(model_key, model_name) for model_key, _, _ in route)
+
+
+# Finished translations, shared with conversion_service when TM_SQLITE_PATH is set
+translation_memory = TranslationMemory()
+
+
 def translate_with_timing(text, source_lang, target_lang):
-    def perform_translation(text, model_dir):
+    model_id = route_model_id(resolve_route(source_lang, target_lang))
+    cached = translation_memory.get(text, source_lang, target_lang, model_id)
+    if cached is not None:
+        return cached
+    translated_text = translate_uncached(text, source_lang, target_lang)
+    translation_memory.put(text, source_lang, target_lang, model_id, translated_text)
+    return translated_text
+
+
+def translate_uncached(text, source_lang, target_lang):
+    def perform_translation(text, direction):
         start_time = time.time()
-        model = TranslatorCT2fromHfHub(
-            model_name_or_path=model_dir,
-            device="cuda",
-            compute_type="int8_float16",
-            tokenizer=AutoTokenizer.from_pretrained(model_dir),
-        )
-        translated_text = model.generate(text=text)
+        src_lang, tgt_lang = direction.split("-")
+        translated_text = batch_scheduler.translate((direction, src_lang, tgt_lang), text)
         end_time = time.time()
         return translated_text, end_time - start_time
 
@@ -93,28 +187,44 @@ def translate_with_timing(text, source_lang, target_lang):
 
     if f"{source_lang}-{target_lang}" in direct_model_mapping:
         translated_text, time_taken = perform_translation(
-            text, direct_model_mapping[f"{source_lang}-{target_lang}"]
+            text, f"{source_lang}-{target_lang}"
         )
         print(
             f"Direct translation time ({source_lang}-{target_lang}): {time_taken:.4f} seconds"
         )
     elif source_lang in supported_langs and target_lang in supported_langs:
-        intermediate_text, time_taken_1 = perform_translation(
-            text, direct_model_mapping[f"{source_lang}-en"]
-        )
-        final_text, time_taken_2 = perform_translation(
-            intermediate_text, direct_model_mapping[f"en-{target_lang}"]
-        )
-        translated_text = final_text
-        total_time_taken = time_taken_1 + time_taken_2
-        print(
-            f"2-step translation time ({source_lang}-en-{target_lang}): {total_time_taken:.4f} seconds"
+        # Both legs run batched together with other pivot requests for this pair
+        translated_text = batch_scheduler.translate(
+            ("pivot", source_lang, target_lang), text
         )
     else:
         translated_text = translate_text(text, source_lang, target_lang)
     return translated_text
 
 
+def translate_segments(texts, source_lang, target_lang):
+    # One batched call for texts that share a language pair; cached texts skip the model
+    route = resolve_route(source_lang, target_lang)
+    model_id = route_model_id(route)
+    results = [
+        translation_memory.get(text, source_lang, target_lang, model_id)
+        for text in texts
+    ]
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    if misses:
+        if len(route) == 2:
+            key = ("pivot", source_lang, target_lang)
+        else:
+            key = route[0]
+        translated = run_translation_batch(key, [texts[i] for i in misses])
+        for i, translated_text in zip(misses, translated):
+            results[i] = translated_text
+            translation_memory.put(
+                texts[i], source_lang, target_lang, model_id, translated_text
+            )
+    return results
+
+
 @app.route("/translate", methods=["GET", "POST"])
 def translate():
     data = request.get_json()
@@ -137,10 +247,201 @@ def translate():
                 "translated_text": translated_text,
             }
         )
+    except UnsupportedLanguage as e:
+        return jsonify({"error": str(e)}), 400
+    except queue.Full as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/translate/batch", methods=["POST"])
+def translate_batch():
+    data = request.get_json(silent=True) or {}
+    segments = data.get("segments")
+    if not isinstance(segments, list) or not segments:
+        return jsonify({"error": "'segments' must be a non-empty list"}), 400
+    if len(segments) > BATCH_MAX_SEGMENTS:
+        return (
+            jsonify({"error": f"Too many segments (max {BATCH_MAX_SEGMENTS})"}),
+            413,
+        )
+
+    default_source = data.get("source_lang", "en")
+    default_target = data.get("target_lang", "vi")
+    items = []
+    for segment in segments:
+        if isinstance(segment, str):
+            segment = {"text": segment}
+        if not isinstance(segment, dict) or not isinstance(segment.get("text"), str):
+            return jsonify({"error": "Each segment needs a 'text' string"}), 400
+        source_lang = segment.get("source_lang", default_source)
+        target_lang = segment.get("target_lang", default_target)
+        try:
+            check_langs(source_lang, target_lang)
+        except UnsupportedLanguage as e:
+            return jsonify({"error": str(e)}), 400
+        if len(segment["text"]) > BATCH_MAX_SEGMENT_CHARS:
+            return (
+                jsonify({"error": f"Segment too long (max {BATCH_MAX_SEGMENT_CHARS} characters)"}),
+                413,
+            )
+        items.append((segment["text"], source_lang, target_lang))
+    if sum(len(text) for text, _, _ in items) > BATCH_MAX_CHARS:
+        return (
+            jsonify({"error": f"Too many characters (max {BATCH_MAX_CHARS})"}),
+            413,
+        )
+
+    translated = [None] * len(items)
+    model_ids = []
+    for index, (text, source_lang, target_lang) in enumerate(items):
+        model_id = route_model_id(resolve_route(source_lang, target_lang))
+        model_ids.append(model_id)
+        translated[index] = translation_memory.get(
+            text, source_lang, target_lang, model_id
+        )
+    misses = [i for i, cached in enumerate(translated) if cached is None]
+
+    # Group segments that share a routing path; each group runs as one batch
+    groups = {}
+    for index in misses:
+        _, source_lang, target_lang = items[index]
+        route = tuple(resolve_route(source_lang, target_lang))
+        groups.setdefault(route, []).append(index)
+
+    # Whitespace tokens are a lower bound on model tokens, so an oversized
+    # request is rejected before any model is loaded or evicted for it
+    estimates = {
+        route: sum(len(items[i][0].split()) for i in indices)
+        for route, indices in groups.items()
+    }
+    if sum(estimates.values()) > BATCH_MAX_TOKENS:
+        return jsonify({"error": f"Too many tokens (max {BATCH_MAX_TOKENS})"}), 413
+
+    try:
+        # Exact counts before anything runs; the character limits above bound
+        # what a model is loaded for
+        total_tokens = 0
+        for route, indices in groups.items():
+            first_model = model_registry.get(route[0][0])
+            total_tokens += sum(
+                len(ids) for ids in first_model.tokenize([items[i][0] for i in indices])
+            )
+        if total_tokens > BATCH_MAX_TOKENS:
+            return (
+                jsonify({"error": f"Too many tokens (max {BATCH_MAX_TOKENS})"}),
+                413,
+            )
+
+        for route, indices in groups.items():
+            group_texts = [items[i][0] for i in indices]
+            if len(route) == 2:
+                leg = ("pivot", route[0][1], route[-1][2])
+            else:
+                leg = route[0]
+            group_texts = run_translation_batch(leg, group_texts)
+            for i, translated_text in zip(indices, group_texts):
+                translated[i] = translated_text
+                text, source_lang, target_lang = items[i]
+                translation_memory.put(
+                    text, source_lang, target_lang, model_ids[i], translated_text
+                )
+
+        return jsonify(
+            {
+                "translations": [
+                    {
+                        "original_text": text,
+                        "source_lang": source_lang,
+                        "target_lang": target_lang,
+                        "translated_text": translated_text,
+                    }
+                    for (text, source_lang, target_lang), translated_text in zip(
+                        items, translated
+                    )
+                ]
+            }
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/translate/stream", methods=["POST"])
+def translate_stream():
+    data = request.get_json(silent=True) or {}
+    original_text = data.get("text", "")
+    source_lang = data.get("source_lang", "en")
+    target_lang = data.get("target_lang", "vi")
+    # Server-Sent Events when the client asks for them, NDJSON otherwise
+    use_sse = "text/event-stream" in request.headers.get("Accept", "")
+    try:
+        check_langs(source_lang, target_lang)
+    except UnsupportedLanguage as e:
+        return jsonify({"error": str(e)}), 400
+
+    sentences = split_sentences(original_text, source_lang)
+    batches = [
+        sentences[i : i + STREAM_BATCH_SENTENCES]
+        for i in range(0, len(sentences), STREAM_BATCH_SENTENCES)
+    ]
+
+    def event(payload):
+        line = json.dumps(payload, ensure_ascii=False)
+        return f"data: {line}\n\n" if use_sse else line + "\n"
+
+    def generate():
+        in_flight = deque()
+        next_batch = 0
+        index = 0
+        try:
+            while next_batch < len(batches) or in_flight:
+                # Keep the pipeline full, then emit the oldest batch in order
+                while next_batch < len(batches) and len(in_flight) < STREAM_PIPELINE_DEPTH:
+                    batch = batches[next_batch]
+                    in_flight.append(
+                        (batch, stream_executor.submit(translate_segments, batch, source_lang, target_lang))
+                    )
+                    next_batch += 1
+                batch, future = in_flight.popleft()
+                for sentence, translated_text in zip(batch, future.result()):
+                    yield event(
+                        {
+                            "index": index,
+                            "original_text": sentence,
+                            "translated_text": translated_text,
+                        }
+                    )
+                    index += 1
+            yield event({"done": True, "segments": index})
+        except Exception as e:
+            for _, future in in_flight:
+                future.cancel()
+            yield event({"error": str(e)})
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    # Ready once the WARM_MODELS warm-up has finished; other directions load on first use
+    status = model_registry.status()
+    status["ready"] = not warm_thread.is_alive()
+    status["pending"] = [d for d in warm_directions if d not in status["resident"]]
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 @app.route("/supported_langs", methods=["GET"])
 def fetch_supported_langs():
     try:
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from backends import load_backend
+from metrics import MODEL_LOAD_SECONDS, MODELS_RESIDENT
+
+# How many direction models may stay loaded at the same time
+MAX_RESIDENT_MODELS = int(os.getenv("MAX_RESIDENT_MODELS", "6"))
+# Comma separated directions to load at startup, e.g. "en-vi,vi-en" or "all"
+WARM_MODELS = os.getenv("WARM_MODELS", "")
+
+
+def parse_warm_models(value, model_mapping):
+    if value.strip() == "all":
+        return list(model_mapping)
+    return [d.strip() for d in value.split(",") if d.strip() in model_mapping]
+
+
+class ModelRegistry:
+    """Process-wide cache of direction models, shared by all threads."""
+
+    def __init__(self, model_mapping, max_resident=MAX_RESIDENT_MODELS, loader=load_backend):
+        self.model_mapping = model_mapping
+        self.max_resident = max(1, max_resident)
+        self.loader = loader
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._loading = set()
+        self._failed = {}
+
+    def _lookup(self, direction):
+        # Caller must hold self._lock
+        model = self._models.get(direction)
+        if model is not None:
+            self._models.move_to_end(direction)
+        return model
+
+    def get(self, direction):
+        """Return the loaded model for a direction such as "en-vi", loading it once if needed."""
+        model_dir = self.model_mapping[direction]
+        with self._lock:
+            model = self._lookup(direction)
+            if model is not None:
+                return model
+            load_lock = self._load_locks.setdefault(direction, threading.Lock())
+
+        # Only one thread loads a given direction; the others wait for it
+        with load_lock:
+            with self._lock:
+                model = self._lookup(direction)
+                if model is not None:
+                    return model
+
+            with self._lock:
+                self._loading.add(direction)
+            start_time = time.time()
+            try:
+                model = self.loader(direction, model_dir)
+            except Exception as e:
+                with self._lock:
+                    self._loading.discard(direction)
+                    self._failed[direction] = str(e)
+                raise
+            load_time = time.time() - start_time
+            MODEL_LOAD_SECONDS.observe(load_time, direction=direction)
+            print(f"Loaded model {direction} in {load_time:.4f} seconds")
+
+            with self._lock:
+                self._loading.discard(direction)
+                self._failed.pop(direction, None)
+                self._models[direction] = model
+                while len(self._models) > self.max_resident:
+                    evicted, _ = self._models.popitem(last=False)
+                    print(f"Evicted model {evicted} (max resident: {self.max_resident})")
+                MODELS_RESIDENT.set(len(self._models))
+        return model
+
+    def warm(self, directions):
+        for direction in directions:
+            try:
+                self.get(direction)
+            except Exception as e:
+                print(f"Failed to warm model {direction}: {e}")
+
+    def warm_in_background(self, directions):
+        """Start loading directions on a daemon thread so startup does not wait for them."""
+        thread = threading.Thread(target=self.warm, args=(list(directions),), daemon=True)
+        thread.start()
+        return thread
+
+    def resident(self):
+        with self._lock:
+            return list(self._models)
+
+    def status(self):
+        with self._lock:
+            return {
+                "resident": list(self._models),
+                "loading": sorted(self._loading),
+                "failed": dict(self._failed),
+            }
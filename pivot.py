@@ -0,0 +1,60 @@
+import time
+import weakref
+import threading
+
+from token_batches import (
+    decode_batch,
+    encode_batch,
+    ids_to_source_tokens,
+    translate_tokens,
+)
+
+# first tokenizer -> {second tokenizer: compatible}; weak so entries go with evicted models
+# and a new tokenizer at a reused address is never given a stale answer
+_compatible_pairs = weakref.WeakKeyDictionary()
+_compatible_lock = threading.Lock()
+
+
+def tokens_compatible(first, second):
+    """True when tokens produced by `first` can be fed to `second` without re-tokenizing."""
+    if first.tokenizer is second.tokenizer:
+        return True
+    with _compatible_lock:
+        known = _compatible_pairs.setdefault(first.tokenizer, weakref.WeakKeyDictionary())
+        if second.tokenizer not in known:
+            known[second.tokenizer] = (
+                type(first.tokenizer) is type(second.tokenizer)
+                and first.tokenizer.get_vocab() == second.tokenizer.get_vocab()
+            )
+        return known[second.tokenizer]
+
+
+def translate_pivot_batch(texts, first, second, source_ids=None):
+    """Translate a batch through two direction models, e.g. vi-en then en-de.
+
+    The English batch from the first leg goes into the second leg as one
+    batch. When both models share a vocabulary the first leg's output tokens
+    are reused directly instead of being decoded and re-encoded. Pass
+    `source_ids` (first-leg token ids) to skip encoding `texts` again.
+    Returns the translations and the time spent in each leg.
+    """
+    start_time = time.time()
+    if source_ids is not None:
+        source_tokens = ids_to_source_tokens(first, source_ids)
+    else:
+        source_tokens = encode_batch(first, texts)
+    hypotheses = translate_tokens(first, source_tokens)
+    first_leg_time = time.time() - start_time
+
+    start_time = time.time()
+    if tokens_compatible(first, second):
+        second_tokens = ids_to_source_tokens(
+            second,
+            [second.tokenizer.convert_tokens_to_ids(tokens) for tokens in hypotheses],
+        )
+    else:
+        second_tokens = encode_batch(second, decode_batch(first, hypotheses))
+    translated = decode_batch(second, translate_tokens(second, second_tokens))
+    second_leg_time = time.time() - start_time
+
+    return translated, {"first_leg": first_leg_time, "second_leg": second_leg_time}
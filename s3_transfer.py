@@ -0,0 +1,199 @@
+"""
+Shared S3 access for the upload API and the conversion worker.
+
+Each process has one pooled client. Multipart transfers are tuned with the
+S3_MULTIPART_* and S3_MAX_CONCURRENCY settings, and the helpers move objects
+to and from streams so that uploads and book results never touch local disk.
+When S3_LOCAL_DIR is set, a directory-backed stand-in replaces S3 for local
+runs and tests. S3_ENDPOINT_URL points the real client at moto or MinIO.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+AWS_REGION = os.getenv("AWS_REGION")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_LOCAL_DIR = os.getenv("S3_LOCAL_DIR", "")
+# Connections shared by all threads; keep it above S3_MAX_CONCURRENCY times
+# the number of transfers that run at once
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8"))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+PRESIGNED_URL_SECONDS = int(os.getenv("PRESIGNED_URL_SECONDS", str(3600 * 24 * 7)))
+# Downloaded books up to this size stay in memory, larger ones spill to a temporary file
+S3_SPOOL_MAX_MB = int(os.getenv("S3_SPOOL_MAX_MB", "8"))
+
+MB = 1024 * 1024
+
+_client = None
+_transfer_config = None
+_lock = threading.Lock()
+
+
+class LocalS3Client:
+    """Directory-backed stand-in for the S3 client calls this service makes."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, bucket, key):
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid key {key}")
+        return path
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name so readers never see a partial object
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(Fileobj, f, MB)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        with open(Filename, "rb") as f:
+            self.upload_fileobj(f, Bucket, Key)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, ExtraArgs=None, Config=None):
+        with open(self._path(Bucket, Key), "rb") as f:
+            shutil.copyfileobj(f, Fileobj, MB)
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Config=None):
+        with open(Filename, "wb") as f:
+            self.download_fileobj(Bucket, Key, f)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        return {"Body": open(path, "rb"), "ContentLength": os.path.getsize(path)}
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        if isinstance(Body, bytes):
+            Body = io.BytesIO(Body)
+        self.upload_fileobj(Body, Bucket, Key)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return "file://" + self._path(Params["Bucket"], Params["Key"])
+
+
+def get_s3_client():
+    """The process-wide S3 client; boto3 clients are safe to share between threads."""
+    global _client
+    with _lock:
+        if _client is None:
+            if S3_LOCAL_DIR:
+                _client = LocalS3Client(S3_LOCAL_DIR)
+            else:
+                import boto3
+                from botocore.config import Config
+
+                _client = boto3.client(
+                    "s3",
+                    region_name=AWS_REGION,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 5, "mode": "adaptive"},
+                    ),
+                )
+        return _client
+
+
+def transfer_config():
+    """Multipart settings for upload_fileobj / download_fileobj, None for the local stand-in."""
+    global _transfer_config
+    if S3_LOCAL_DIR:
+        return None
+    with _lock:
+        if _transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+
+            _transfer_config = TransferConfig(
+                multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+                multipart_chunksize=S3_MULTIPART_CHUNKSIZE_MB * MB,
+                max_concurrency=S3_MAX_CONCURRENCY,
+                use_threads=True,
+            )
+        return _transfer_config
+
+
+class LineStream(io.RawIOBase):
+    """Readable binary stream over an iterator of strings.
+
+    Lets upload_fileobj send text as it is produced: parts are uploaded while
+    later lines are still being generated.
+    """
+
+    def __init__(self, lines, encoding="utf-8"):
+        self._lines = iter(lines)
+        self._encoding = encoding
+        self._buffer = bytearray()
+        # An exception raised by `lines`; the uploader may wrap it in its own error
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # Fill the whole buffer unless the lines run out, so only the last read is short
+        while len(self._buffer) < len(b):
+            try:
+                line = next(self._lines, None)
+            except Exception as e:
+                self.error = e
+                raise
+            if line is None:
+                break
+            self._buffer += line.encode(self._encoding)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        return size
+
+
+def upload_stream(fileobj, bucket, key):
+    get_s3_client().upload_fileobj(fileobj, bucket, key, Config=transfer_config())
+
+
+def read_text_object(bucket, key, encoding="utf-8"):
+    """Download an object and return it as a text file object.
+
+    The download uses parallel ranged requests into a spooled file: small
+    objects stay in memory and large ones go to an unlinked temporary file, so
+    memory stays bounded however many books run at once, and no GET is held
+    open while a long translation is running.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_MB * MB)
+    try:
+        get_s3_client().download_fileobj(bucket, key, body, Config=transfer_config())
+    except Exception:
+        body.close()
+        raise
+    body.seek(0)
+    return io.TextIOWrapper(body, encoding=encoding)
+
+
+def presigned_url(bucket, key, expires=PRESIGNED_URL_SECONDS):
+    return get_s3_client().generate_presigned_url(
+        "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires
+    )
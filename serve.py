@@ -0,0 +1,302 @@
+"""
+Production serving mode for the translation API.
+
+Starts SERVE_WORKERS worker processes, each running main.py under waitress
+with its own subset of the models warm, and a router in front of them that
+sends every request to the worker holding the models its language pair needs.
+
+* Run:
+    python serve.py
+
+Placement is automatic (m2m100 on its own worker, direction models spread
+over the rest) or explicit with SERVE_PLACEMENT, e.g.
+    SERVE_PLACEMENT="en-vi,vi-en;en-de,de-en,en-fr,fr-en;m2m"
+"""
+
+import os
+import sys
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from waitress import serve
+
+load_dotenv()
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "5000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))
+SERVE_BASE_PORT = int(os.getenv("SERVE_BASE_PORT", "5100"))
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "16"))
+SERVE_PLACEMENT = os.getenv("SERVE_PLACEMENT", "")
+# main.py's /translate/batch limits for the whole request; each worker only sees its part
+BATCH_MAX_SEGMENTS = int(os.getenv("BATCH_MAX_SEGMENTS", "512"))
+BATCH_MAX_CHARS = int(os.getenv("BATCH_MAX_CHARS", "65536"))
+
+supported_langs = ["en", "es", "fr", "de", "zh", "vi", "ko", "th", "ja"]
+
+
+def load_model_names(file_path):
+    model_names = {}
+    with open(file_path, "r") as f:
+        for line in f:
+            key, value = line.strip().split("=")
+            model_names[key] = value
+    return model_names
+
+
+directions = list(load_model_names("model_names.cfg"))
+
+
+def route_models(source_lang, target_lang):
+    # Same routing rules as main.resolve_route, without importing main
+    direction = f"{source_lang}-{target_lang}"
+    if direction in ["en-ko", "en-th", "en-ja"]:
+        return ["m2m"]
+    if direction in directions:
+        return [direction]
+    if source_lang in supported_langs and target_lang in supported_langs:
+        return [f"{source_lang}-en", f"en-{target_lang}"]
+    return ["m2m"]
+
+
+def plan_placement(workers, placement=SERVE_PLACEMENT):
+    """Return one list of models per worker."""
+    if placement:
+        groups = [
+            [d.strip() for d in group.split(",") if d.strip()]
+            for group in placement.split(";")
+        ]
+        return groups[:workers] + [[] for _ in range(workers - len(groups))]
+    if workers == 1:
+        return [directions + ["m2m"]]
+    # m2m100 is the largest model, so it gets a worker of its own
+    groups = [["m2m"]] + [[] for _ in range(workers - 1)]
+    for i, direction in enumerate(directions):
+        groups[1 + i % (workers - 1)].append(direction)
+    return groups
+
+
+def start_workers(placement):
+    processes = []
+    for i, models in enumerate(placement):
+        env = dict(os.environ)
+        env["WARM_MODELS"] = ",".join(models)
+        # Leave room for every placed model so the warm set is not evicted
+        resident = int(os.getenv("MAX_RESIDENT_MODELS", "6"))
+        env["MAX_RESIDENT_MODELS"] = str(max(resident, len(models) + 1))
+        env["SERVE_WORKER_PORT"] = str(SERVE_BASE_PORT + i)
+        processes.append(
+            subprocess.Popen([sys.executable, __file__, "worker"], env=env)
+        )
+        print(f"Started worker {i} on port {SERVE_BASE_PORT + i} with {models}")
+    return processes
+
+
+def run_worker():
+    import main
+
+    serve(
+        main.app,
+        host="127.0.0.1",
+        port=int(os.environ["SERVE_WORKER_PORT"]),
+        threads=SERVE_THREADS,
+    )
+
+
+class Router:
+    """Sends each language pair to the worker that holds most of its models."""
+
+    def __init__(self, placement):
+        self.urls = [f"http://127.0.0.1:{SERVE_BASE_PORT + i}" for i in range(len(placement))]
+        self.placement = [set(models) for models in placement]
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=SERVE_THREADS * 2)
+        self.session.mount("http://", adapter)
+        self._round_robin = itertools.cycle(range(len(placement)))
+        # Built once here, so request threads only read it; any other pair is m2m's
+        pairs = {(s, t) for s in supported_langs for t in supported_langs}
+        pairs.update(tuple(d.split("-", 1)) for d in directions)
+        self._pairs = {pair: self._place(route_models(*pair)) for pair in sorted(pairs)}
+        self._m2m_worker = self._place(["m2m"])
+
+    def _place(self, needed):
+        scores = [len(models.intersection(needed)) for models in self.placement]
+        best = max(scores)
+        if best == 0:
+            # Nobody has it warm; spread the lazy loads over the workers
+            return next(self._round_robin)
+        return scores.index(best)
+
+    def worker_for(self, source_lang, target_lang):
+        return self._pairs.get((source_lang, target_lang), self._m2m_worker)
+
+    def forward(self, worker, path, method="POST", **kwargs):
+        return self.session.request(method, self.urls[worker] + path, timeout=600, **kwargs)
+
+
+def create_router_app(router):
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS for all routes
+
+    def relay(response):
+        return Response(
+            response.content,
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type"),
+            headers={k: v for k, v in response.headers.items() if k == "Retry-After"},
+        )
+
+    def proxy(worker, path, method="POST", **kwargs):
+        try:
+            return relay(router.forward(worker, path, method, **kwargs))
+        except requests.RequestException as e:
+            # The worker is still starting or has died
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
+    @app.route("/translate", methods=["GET", "POST"])
+    def translate():
+        if request.method == "GET":
+            source_lang = request.args.get("source_lang", "en")
+            target_lang = request.args.get("target_lang", "vi")
+            worker = router.worker_for(source_lang, target_lang)
+            return proxy(worker, "/translate", "GET", params=request.args)
+        data = request.get_json(silent=True) or {}
+        worker = router.worker_for(
+            data.get("source_lang", "en"), data.get("target_lang", "vi")
+        )
+        return proxy(worker, "/translate", json=data)
+
+    @app.route("/translate/stream", methods=["POST"])
+    def translate_stream():
+        data = request.get_json(silent=True) or {}
+        worker = router.worker_for(
+            data.get("source_lang", "en"), data.get("target_lang", "vi")
+        )
+        try:
+            response = router.forward(
+                worker,
+                "/translate/stream",
+                json=data,
+                headers={"Accept": request.headers.get("Accept", "")},
+                stream=True,
+            )
+        except requests.RequestException as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        # Pass segments on as soon as the worker sends them
+        return Response(
+            response.iter_content(chunk_size=None),
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type"),
+        )
+
+    @app.route("/translate/batch", methods=["POST"])
+    def translate_batch():
+        data = request.get_json(silent=True) or {}
+        segments = data.get("segments")
+        if not isinstance(segments, list) or not segments:
+            return proxy(0, "/translate/batch", json=data)
+        if len(segments) > BATCH_MAX_SEGMENTS:
+            return (
+                jsonify({"error": f"Too many segments (max {BATCH_MAX_SEGMENTS})"}),
+                413,
+            )
+        texts = [s.get("text") if isinstance(s, dict) else s for s in segments]
+        if sum(len(text) for text in texts if isinstance(text, str)) > BATCH_MAX_CHARS:
+            return (
+                jsonify({"error": f"Too many characters (max {BATCH_MAX_CHARS})"}),
+                413,
+            )
+
+        # Split the segments by worker, translate the parts in parallel and
+        # put the results back in input order
+        default_source = data.get("source_lang", "en")
+        default_target = data.get("target_lang", "vi")
+        parts = {}
+        for index, segment in enumerate(segments):
+            if isinstance(segment, dict):
+                source_lang = segment.get("source_lang", default_source)
+                target_lang = segment.get("target_lang", default_target)
+            else:
+                source_lang, target_lang = default_source, default_target
+            worker = router.worker_for(source_lang, target_lang)
+            parts.setdefault(worker, []).append(index)
+        if len(parts) == 1:
+            return proxy(next(iter(parts)), "/translate/batch", json=data)
+
+        def send(worker, indices):
+            part = dict(data, segments=[segments[i] for i in indices])
+            return worker, indices, router.forward(worker, "/translate/batch", json=part)
+
+        translations = [None] * len(segments)
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                results = list(executor.map(lambda p: send(*p), parts.items()))
+        except requests.RequestException as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+        for worker, indices, response in results:
+            if response.status_code != 200:
+                return relay(response)
+            for i, translation in zip(indices, response.json()["translations"]):
+                translations[i] = translation
+        return jsonify({"translations": translations})
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"status": "ok"}), 200
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        workers = []
+        for i in range(len(router.urls)):
+            try:
+                response = router.forward(i, "/ready", "GET")
+                workers.append(dict(response.json(), worker=i))
+            except Exception as e:
+                workers.append({"worker": i, "ready": False, "error": str(e)})
+        all_ready = all(w.get("ready") for w in workers)
+        return jsonify({"ready": all_ready, "workers": workers}), 200 if all_ready else 503
+
+    @app.route("/metrics/<int:worker>", methods=["GET"])
+    def metrics(worker):
+        # Every worker keeps its own metrics; scrape them one worker at a time
+        if worker >= len(router.urls):
+            return jsonify({"error": f"No worker {worker}"}), 404
+        return proxy(worker, "/metrics", "GET")
+
+    @app.route("/supported_langs", methods=["GET"])
+    def fetch_supported_langs():
+        return proxy(0, "/supported_langs", "GET")
+
+    return app
+
+
+def run_router():
+    placement = plan_placement(SERVE_WORKERS)
+    processes = start_workers(placement)
+    try:
+        serve(
+            create_router_app(Router(placement)),
+            host=SERVE_HOST,
+            port=SERVE_PORT,
+            threads=SERVE_THREADS,
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        run_worker()
+    else:
+        run_router()
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SQS_WAIT_SECONDS = int(os.getenv("SQS_WAIT_SECONDS", "20"))
+SQS_BATCH_SIZE = int(os.getenv("SQS_BATCH_SIZE", "10"))
+# Books translated side by side; their batches share the model through job_scheduler
+SQS_WORKERS = int(os.getenv("SQS_WORKERS", "8"))
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", "300"))
+# How often a running job pushes its message's visibility timeout forward
+SQS_HEARTBEAT_SECONDS = int(os.getenv("SQS_HEARTBEAT_SECONDS", "120"))
+# Delivery attempts per message when the queue has no redrive policy to read it from
+SQS_MAX_RECEIVES = int(os.getenv("SQS_MAX_RECEIVES", "5"))
+
+
+# SQS's limit on DelaySeconds
+MAX_DELAY_SECONDS = 900
+
+
+class Deferred(Exception):
+    """Raised by a handler to put its message back on the queue for `delay_seconds`.
+
+    The message is sent again with a delay and the original deleted, so a
+    deferral does not use up one of its delivery attempts.
+    """
+
+    def __init__(self, message, delay_seconds=60):
+        super().__init__(message)
+        self.delay_seconds = delay_seconds
+
+
+class InvalidMessage(Exception):
+    """Raised by a handler for a message it can never process; the message is deleted."""
+
+
+class SQSConsumer:
+    """Long-polls a queue and runs each message body through `handler` on a bounded pool.
+
+    Messages are only received when a worker is free, stay invisible while
+    their job runs (a heartbeat extends the visibility timeout), and are
+    deleted only after `handler` returns. A failed job is left on the queue
+    so SQS redelivers it (or moves it to a dead-letter queue). Messages that
+    are not JSON, or that the handler rejects with InvalidMessage, are deleted
+    since no retry can succeed.
+
+    When a message fails on its last delivery attempt (the redrive policy's
+    maxReceiveCount, or `max_receives` without one) `on_give_up(body, error)`
+    is called. Without a dead-letter queue the message is then deleted.
+    """
+
+    def __init__(
+        self,
+        sqs_client,
+        queue_url,
+        handler,
+        workers=SQS_WORKERS,
+        batch_size=SQS_BATCH_SIZE,
+        wait_seconds=SQS_WAIT_SECONDS,
+        visibility_timeout=SQS_VISIBILITY_TIMEOUT,
+        heartbeat_seconds=SQS_HEARTBEAT_SECONDS,
+        max_receives=SQS_MAX_RECEIVES,
+        on_give_up=None,
+    ):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, min(batch_size, 10))
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.on_give_up = on_give_up
+        redrive_max_receives = self._redrive_max_receives()
+        # With a dead-letter queue SQS moves the message after its last attempt
+        self.dead_letter_queue = redrive_max_receives is not None
+        self.max_receives = redrive_max_receives or max(1, max_receives)
+        self._slots = threading.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._stopped = threading.Event()
+
+    def _redrive_max_receives(self):
+        try:
+            attributes = self.sqs.get_queue_attributes(
+                QueueUrl=self.queue_url, AttributeNames=["RedrivePolicy"]
+            ).get("Attributes", {})
+        except Exception as e:
+            print(f"Failed to read the queue's redrive policy: {e}")
+            return None
+        policy = attributes.get("RedrivePolicy")
+        return int(json.loads(policy)["maxReceiveCount"]) if policy else None
+
+    def poll_once(self):
+        """Receive up to as many messages as there are free workers and start them."""
+        self._slots.acquire()
+        free = 1
+        while free < self.batch_size and self._slots.acquire(blocking=False):
+            free += 1
+
+        try:
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                AttributeNames=["All"],
+                MaxNumberOfMessages=free,
+                MessageAttributeNames=["All"],
+                VisibilityTimeout=self.visibility_timeout,
+                WaitTimeSeconds=self.wait_seconds,
+            )
+        except Exception:
+            for _ in range(free):
+                self._slots.release()
+            raise
+
+        messages = response.get("Messages", [])
+        for message in messages:
+            self._executor.submit(self._run, message)
+        for _ in range(free - len(messages)):
+            self._slots.release()
+        return len(messages)
+
+    def _heartbeat(self, receipt_handle, done):
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                self.sqs.change_message_visibility(
+                    QueueUrl=self.queue_url,
+                    ReceiptHandle=receipt_handle,
+                    VisibilityTimeout=self.visibility_timeout,
+                )
+            except Exception as e:
+                print(f"Failed to extend message visibility: {e}")
+
+    def _defer(self, message, delay_seconds):
+        kwargs = {}
+        if message.get("MessageAttributes"):
+            kwargs["MessageAttributes"] = message["MessageAttributes"]
+        try:
+            self.sqs.send_message(
+                QueueUrl=self.queue_url,
+                MessageBody=message["Body"],
+                DelaySeconds=int(min(max(delay_seconds, 0), MAX_DELAY_SECONDS)),
+                **kwargs,
+            )
+        except Exception as e:
+            # Not sent again: leave the original to reappear after its visibility timeout
+            print(f"Failed to defer message: {e}")
+            return
+        try:
+            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"])
+        except Exception as e:
+            print(f"Failed to delete deferred message: {e}")
+
+    def _give_up(self, message, body, error):
+        print(f"Giving up on message {message.get('MessageId')} after {self.max_receives} attempts")
+        if self.on_give_up is not None:
+            try:
+                self.on_give_up(body, error)
+            except Exception as e:
+                print(f"Failed to record the failed message: {e}")
+        if not self.dead_letter_queue:
+            try:
+                self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"])
+            except Exception as e:
+                print(f"Failed to delete message: {e}")
+
+    def _run(self, message):
+        receipt_handle = message["ReceiptHandle"]
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(receipt_handle, done), daemon=True
+        )
+        heartbeat.start()
+        body = None
+        try:
+            try:
+                body = json.loads(message["Body"])
+            except ValueError as e:
+                raise InvalidMessage(f"Message body is not JSON: {e}")
+            self.handler(body)
+            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt_handle)
+        except InvalidMessage as e:
+            print(f"Dropping message {message.get('MessageId')}: {e}")
+            try:
+                self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt_handle)
+            except Exception as e:
+                print(f"Failed to delete message: {e}")
+        except Deferred as e:
+            print(f"Deferred message for {e.delay_seconds} seconds: {e}")
+            self._defer(message, e.delay_seconds)
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            receive_count = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+            if receive_count >= self.max_receives:
+                self._give_up(message, body, e)
+        finally:
+            done.set()
+            self._slots.release()
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"An error occurred while polling: {e}")
+                time.sleep(5)
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        self._executor.shutdown(wait=wait)
+
+
+class InMemorySQS:
+    """Local stand-in for the subset of the boto3 SQS client used by SQSConsumer."""
+
+    def __init__(self, max_receive_count=None):
+        self._messages = {}
+        self._order = []
+        self._condition = threading.Condition()
+        self.deleted = []
+        # Messages past max_receive_count move here, like a redrive policy's dead-letter queue
+        self.max_receive_count = max_receive_count
+        self.dead_letters = []
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        attributes = {}
+        if self.max_receive_count:
+            attributes["RedrivePolicy"] = json.dumps(
+                {"deadLetterTargetArn": "dead-letters", "maxReceiveCount": self.max_receive_count}
+            )
+        return {"Attributes": attributes}
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        message_id = str(uuid.uuid4())
+        with self._condition:
+            self._messages[message_id] = {
+                "Body": MessageBody,
+                "visible_at": time.time() + DelaySeconds,
+                "receipt": None,
+                "receives": 0,
+            }
+            self._order.append(message_id)
+            self._condition.notify_all()
+        return {"MessageId": message_id}
+
+    def _visible(self, now):
+        return [m for m in self._order if self._messages[m]["visible_at"] <= now]
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=30, WaitTimeSeconds=0, **kwargs):
+        deadline = time.time() + WaitTimeSeconds
+        with self._condition:
+            while True:
+                now = time.time()
+                visible = self._visible(now)[:MaxNumberOfMessages]
+                if visible or now >= deadline:
+                    break
+                self._condition.wait(min(deadline - now, 0.05))
+            messages = []
+            for message_id in visible:
+                message = self._messages[message_id]
+                if self.max_receive_count and message["receives"] >= self.max_receive_count:
+                    del self._messages[message_id]
+                    self._order.remove(message_id)
+                    self.dead_letters.append(message_id)
+                    continue
+                message["visible_at"] = now + VisibilityTimeout
+                message["receipt"] = f"{message_id}:{uuid.uuid4()}"
+                message["receives"] += 1
+                messages.append(
+                    {
+                        "MessageId": message_id,
+                        "Body": message["Body"],
+                        "ReceiptHandle": message["receipt"],
+                        "Attributes": {"ApproximateReceiveCount": str(message["receives"])},
+                    }
+                )
+        return {"Messages": messages} if messages else {}
+
+    def _find(self, receipt_handle):
+        message_id = receipt_handle.split(":", 1)[0]
+        message = self._messages.get(message_id)
+        if message is None or message["receipt"] != receipt_handle:
+            raise ValueError("Receipt handle is invalid")
+        return message_id, message
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        with self._condition:
+            _, message = self._find(ReceiptHandle)
+            message["visible_at"] = time.time() + VisibilityTimeout
+            self._condition.notify_all()
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self._condition:
+            message_id, _ = self._find(ReceiptHandle)
+            del self._messages[message_id]
+            self._order.remove(message_id)
+            self.deleted.append(message_id)
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from batching import BatchScheduler
+
+
+class RecordingBatch:
+    """run_batch stub that records each batch and upper-cases its texts."""
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.release = release
+
+    def __call__(self, key, texts):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batches.append((key, list(texts)))
+        return [text.upper() for text in texts]
+
+
+def test_full_batch_is_flushed_without_waiting():
+    run_batch = RecordingBatch()
+    scheduler = BatchScheduler(run_batch, max_batch_size=3, max_wait_ms=10_000)
+    start = time.monotonic()
+    futures = [scheduler.submit("k", text) for text in ("a", "b", "c")]
+    assert [f.result(timeout=5) for f in futures] == ["A", "B", "C"]
+    assert time.monotonic() - start < 5
+    assert run_batch.batches == [("k", ["a", "b", "c"])]
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    run_batch = RecordingBatch()
+    scheduler = BatchScheduler(run_batch, max_batch_size=32, max_wait_ms=50)
+    start = time.monotonic()
+    futures = [scheduler.submit("k", text) for text in ("a", "b")]
+    assert [f.result(timeout=5) for f in futures] == ["A", "B"]
+    assert time.monotonic() - start >= 0.05
+    assert run_batch.batches == [("k", ["a", "b"])]
+
+
+def test_keys_are_batched_separately():
+    run_batch = RecordingBatch()
+    scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=10_000)
+    futures = [scheduler.submit(key, text) for key, text in (("x", "a"), ("y", "b"), ("x", "c"), ("y", "d"))]
+    assert [f.result(timeout=5) for f in futures] == ["A", "B", "C", "D"]
+    assert sorted(run_batch.batches) == [("x", ["a", "c"]), ("y", ["b", "d"])]
+
+
+def test_submit_raises_queue_full_at_the_limit():
+    release = threading.Event()
+    scheduler = BatchScheduler(RecordingBatch(release), max_batch_size=1, max_wait_ms=0, max_queue_size=2)
+    first = scheduler.submit("k", "a")
+    # Wait for the worker to take the first request, so it no longer counts
+    while scheduler.queue_depth():
+        time.sleep(0.01)
+    scheduler.submit("k", "b")
+    scheduler.submit("k", "c")
+    with pytest.raises(queue.Full):
+        scheduler.submit("k", "d")
+    release.set()
+    assert first.result(timeout=5) == "A"
+
+
+def test_exceptions_reach_every_request_of_the_batch():
+    def run_batch(key, texts):
+        raise RuntimeError("model failed")
+
+    scheduler = BatchScheduler(run_batch, max_batch_size=2, max_wait_ms=10_000)
+    futures = [scheduler.submit("k", text) for text in ("a", "b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(timeout=5)
+
+
+def test_wrong_result_count_fails_the_batch():
+    scheduler = BatchScheduler(lambda key, texts: ["only one"], max_batch_size=2, max_wait_ms=10_000)
+    futures = [scheduler.submit("k", text) for text in ("a", "b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="returned 1 results for 2 inputs"):
+            future.result(timeout=5)
+
+
+def test_idle_workers_exit_and_restart_on_demand():
+    before = threading.active_count()
+    scheduler = BatchScheduler(RecordingBatch(), max_batch_size=1, max_wait_ms=0, idle_seconds=0.05)
+    assert scheduler.translate("k", "a", timeout=5) == "A"
+    deadline = time.monotonic() + 5
+    while (scheduler._queues or threading.active_count() > before) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler._queues == {}
+    assert threading.active_count() == before
+    assert scheduler.translate("k", "b", timeout=5) == "B"
+
+
+def test_unsupported_languages_are_rejected_before_batching(monkeypatch):
+    monkeypatch.setenv("TRANSLATION_BACKEND", "fake")
+    main = pytest.importorskip("main")
+    client = main.app.test_client()
+    before = threading.active_count()
+    for i in range(20):
+        response = client.post("/translate", json={"text": "hi", "source_lang": f"x{i}", "target_lang": "en"})
+        assert response.status_code == 400
+    response = client.post("/translate/batch", json={"segments": ["hi"], "source_lang": "en", "target_lang": ["vi"]})
+    assert response.status_code == 400
+    assert threading.active_count() == before
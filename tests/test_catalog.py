@@ -0,0 +1,110 @@
+import gc
+import os
+import sys
+import csv
+import weakref
+import importlib.util
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+BOOK_API = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "book-api")
+sys.path.insert(0, BOOK_API)
+
+from catalog import Catalog, FORMAT_VERSION, load_catalog  # noqa: E402
+
+COLUMNS = ["Book ID", "Author", "Title", "LoC Class", "Subjects", "EBook-No.", "Downloads"]
+
+
+def book(i, ebook_no=None, subjects="Fiction"):
+    return [str(i), f"Author {i}", f"Title {i}", "PS: American literature", subjects,
+            str(i) if ebook_no is None else ebook_no, f"{i * 10} downloads in the last 30 days."]
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+def test_round_trip_keeps_the_scraped_text(tmp_path):
+    rows = [book(1), book(2, ebook_no=""), book(3, subjects="Science Fiction; Ünïcödé")]
+    write_csv(tmp_path / "books.csv", rows)
+    catalog = Catalog.from_csv(tmp_path / "books.csv")
+    catalog.save(tmp_path / "catalog.npz")
+    loaded = Catalog.load(tmp_path / "catalog.npz")
+
+    assert loaded.columns == COLUMNS
+    for row, expected in enumerate(rows):
+        assert catalog.record(row) == loaded.record(row) == dict(zip(COLUMNS, expected))
+    assert loaded.downloads.tolist() == [10, 20, 30]
+    assert sorted(os.listdir(tmp_path)) == ["books.csv", "catalog.npz"]
+
+
+def test_columns_have_the_same_type_whatever_the_rows_hold(tmp_path):
+    write_csv(tmp_path / "full.csv", [book(1), book(2)])
+    write_csv(tmp_path / "gap.csv", [book(1), book(2, ebook_no="")])
+    for name in ("full.csv", "gap.csv"):
+        record = Catalog.from_csv(tmp_path / name).record(0)
+        assert record["EBook-No."] == "1"
+        assert record["Book ID"] == "1"
+        assert record["Downloads"] == "10 downloads in the last 30 days."
+
+
+def test_load_catalog_rebuilds_from_a_newer_csv_or_older_format(tmp_path):
+    csv_path, path = tmp_path / "books.csv", tmp_path / "catalog.npz"
+    write_csv(csv_path, [book(1)])
+    assert len(load_catalog(csv_path, path)) == 1
+    assert path.exists()
+
+    write_csv(csv_path, [book(1), book(2)])
+    os.utime(csv_path, (os.path.getmtime(path) + 10,) * 2)
+    assert len(load_catalog(csv_path, path)) == 2
+    assert len(Catalog.load(path)) == 2
+
+    np.savez(path, format=np.array(FORMAT_VERSION - 1), columns=np.array(COLUMNS))
+    os.utime(path, (os.path.getmtime(csv_path) + 10,) * 2)
+    assert len(load_catalog(csv_path, path)) == 2
+    assert int(np.load(path)["format"]) == FORMAT_VERSION
+
+
+@pytest.fixture
+def book_app(tmp_path, monkeypatch):
+    pytest.importorskip("flask")
+    write_csv(tmp_path / "book_info_final.csv", [book(1), book(2, subjects="Science Fiction")])
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CATALOG_WATCH_SECONDS", "0")
+    monkeypatch.setenv("CATALOG_CSV", "book_info_final.csv")
+    monkeypatch.setenv("CATALOG_PATH", "catalog.npz")
+    spec = importlib.util.spec_from_file_location("book_api_app", os.path.join(BOOK_API, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, "book_api_app", module)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_filters_match_substrings_and_reject_bad_limits(book_app):
+    client = book_app.app.test_client()
+    assert [b["Book ID"] for b in client.get("/api/books?Subjects=fiction").json] == ["1", "2"]
+    assert client.get("/api/filters?limit=x").status_code == 400
+    assert client.get("/api/filters?limit=-1").status_code == 400
+    client.get("/api/filters?unknown=1")
+    assert book_app.filters_body.cache_info().currsize == 1
+
+
+def test_reload_swaps_the_catalog_and_releases_the_old_one(book_app, tmp_path):
+    client = book_app.app.test_client()
+    assert len(client.get("/api/books").json) == 2
+    old_index = weakref.ref(book_app.book_index)
+
+    write_csv(tmp_path / "book_info_final.csv", [book(i) for i in range(1, 6)])
+    os.utime("book_info_final.csv", (os.path.getmtime("catalog.npz") + 10,) * 2)
+    book_app.reload_catalog()
+
+    assert book_app.catalog_generation == 1
+    assert len(client.get("/api/books").json) == 5
+    assert client.get("/api/filters?facet=Author").json["Author"][0]["count"] == 1
+    gc.collect()
+    assert old_index() is None
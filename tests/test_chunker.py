@@ -0,0 +1,61 @@
+import pytest
+
+from backends import FakeTokenizer
+from chunker import chunk_text, sentence_spans, split_sentences
+
+
+def test_decimals_and_urls_stay_in_their_sentence():
+    assert split_sentences("Pi is 3.14 today. Next one? Yes", "vi") == ["Pi is 3.14 today.", "Next one?", "Yes"]
+    assert split_sentences("See https://example.com/a.b?c=1 now! Ok.", "vi") == [
+        "See https://example.com/a.b?c=1 now!",
+        "Ok.",
+    ]
+
+
+def test_cjk_marks_end_sentences_without_a_space():
+    assert split_sentences("你好。世界！再见？ 好", "zh") == ["你好。", "世界！", "再见？", "好"]
+
+
+def test_spans_exclude_surrounding_whitespace():
+    text = "  One.  Two.\nThree.  "
+    spans = sentence_spans(text, "vi")
+    assert spans == [(2, 6), (8, 12), (13, 19)]
+    assert [text[start:end] for start, end in spans] == ["One.", "Two.", "Three."]
+    assert sentence_spans("   ", "vi") == []
+
+
+def test_abbreviations_stay_in_their_sentence():
+    from nltk.tokenize import sent_tokenize
+
+    try:
+        sent_tokenize("Probe.", language="english")
+    except LookupError:
+        pytest.skip("punkt data is not installed")
+    assert split_sentences("Mr. Smith arrived. He left.", "en") == ["Mr. Smith arrived.", "He left."]
+
+
+def test_chunks_keep_the_separators_between_sentences():
+    tokenizer = FakeTokenizer()
+    text = "One two.  Three four.\nFive six. Seven."
+    chunks = chunk_text(text, tokenizer, max_tokens=4, lang="vi")
+    assert [chunk for chunk, _ in chunks] == ["One two.  Three four.", "Five six. Seven."]
+    for chunk, ids in chunks:
+        assert ids == tokenizer.encode(chunk, add_special_tokens=False)
+
+
+def test_oversized_sentence_is_split_on_token_boundaries():
+    tokenizer = FakeTokenizer()
+    text = "Short one. w1 w2 w3 w4 w5 w6 w7 w8 w9 w10. End."
+    chunks = chunk_text(text, tokenizer, max_tokens=4, lang="vi")
+    assert [chunk for chunk, _ in chunks] == [
+        "Short one.",
+        "w1 w2 w3 w4",
+        "w5 w6 w7 w8",
+        "w9 w10.",
+        "End.",
+    ]
+    assert all(len(ids) <= 4 for _, ids in chunks)
+
+
+def test_empty_text_has_no_chunks():
+    assert chunk_text("", FakeTokenizer(), max_tokens=4, lang="vi") == []
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+from job_scheduler import PRIORITY_TIERS, SMALL_JOB_BYTES, FairScheduler, job_priority
+
+HIGH, NORMAL, BULK = PRIORITY_TIERS["high"], PRIORITY_TIERS["normal"], PRIORITY_TIERS["bulk"]
+
+
+class GatedBatch:
+    """run_batch stub that holds its first call until released, so requests queue up behind it."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+
+    def __call__(self, key, texts, batch_ids):
+        self.calls.append((key, list(texts)))
+        self.started.set()
+        self.gate.wait(5)
+        return [text.upper() for text in texts]
+
+    def order(self):
+        # Texts of each call after the blocker, in the order they ran
+        return [texts for _, texts in self.calls[1:]]
+
+
+def make_scheduler(**kwargs):
+    run_batch = GatedBatch()
+    scheduler = FairScheduler(run_batch, slots=1, **kwargs)
+    blocker = scheduler.submit("blocker", HIGH, "block", ["wait here"], [None])
+    assert run_batch.started.wait(5)
+    return scheduler, run_batch, blocker
+
+
+def submit(scheduler, owner, priority, key, *texts):
+    return scheduler.submit(owner, priority, key, texts, [None] * len(texts))
+
+
+def drain(run_batch, *futures):
+    run_batch.gate.set()
+    return [future.result(timeout=5) for future in futures]
+
+
+def test_better_tiers_run_first():
+    scheduler, run_batch, blocker = make_scheduler()
+    futures = [
+        submit(scheduler, "a", BULK, "en-vi", "bulk book"),
+        submit(scheduler, "b", NORMAL, "en-de", "normal book"),
+        submit(scheduler, "c", HIGH, "en-fr", "high book"),
+    ]
+    drain(run_batch, blocker, *futures)
+    assert run_batch.order() == [["high book"], ["normal book"], ["bulk book"]]
+
+
+def test_waiting_batches_move_up_a_tier():
+    scheduler, run_batch, blocker = make_scheduler(aging_seconds=0.05)
+    old_bulk = submit(scheduler, "a", BULK, "en-vi", "old bulk")
+    time.sleep(0.15)
+    new_high = submit(scheduler, "b", HIGH, "en-de", "new high")
+    drain(run_batch, blocker, old_bulk, new_high)
+    assert run_batch.order() == [["old bulk"], ["new high"]]
+
+
+def test_owners_get_a_fair_share_and_idle_owners_are_forgotten():
+    # One text per batch, so nothing is topped up and every batch runs on its own
+    scheduler, run_batch, blocker = make_scheduler(max_batch_size=1)
+    futures = [submit(scheduler, "a", NORMAL, "en-vi", f"a{i} x") for i in range(3)]
+    futures += [submit(scheduler, "b", NORMAL, "en-vi", f"b{i} x") for i in range(2)]
+    drain(run_batch, blocker, *futures)
+    assert run_batch.order() == [["a0 x"], ["b0 x"], ["a1 x"], ["b1 x"], ["a2 x"]]
+    # Only the owner ahead of the clock is still tracked
+    assert list(scheduler._served) == ["a"]
+    assert scheduler._served["a"] > scheduler._clock
+
+
+def test_returning_owner_starts_at_the_clock():
+    scheduler, run_batch, blocker = make_scheduler(max_batch_size=1)
+    futures = [submit(scheduler, "a", NORMAL, "en-vi", f"a{i} x") for i in range(3)]
+    drain(run_batch, blocker, *futures)
+
+    run_batch.gate.clear()
+    blocker = scheduler.submit("blocker", HIGH, "block", ["wait here"], [None])
+    while len(run_batch.calls) < 5:
+        time.sleep(0.01)
+    # b is not owed the tokens a was served while b was away, nor does it queue behind them
+    late = submit(scheduler, "b", NORMAL, "en-vi", "b0 x")
+    assert scheduler._served["b"] == scheduler._clock > 0
+    again = submit(scheduler, "a", NORMAL, "en-vi", "a3 x")
+    drain(run_batch, blocker, late, again)
+    assert run_batch.order()[-2:] == [["b0 x"], ["a3 x"]]
+
+
+def test_batches_are_topped_up_across_jobs_on_the_same_pair():
+    scheduler, run_batch, blocker = make_scheduler(max_batch_size=4)
+    first = submit(scheduler, "a", NORMAL, "en-vi", "one", "two")
+    other_pair = submit(scheduler, "c", NORMAL, "en-de", "other")
+    second = submit(scheduler, "b", NORMAL, "en-vi", "three", "four")
+    results = drain(run_batch, blocker, first, other_pair, second)
+    assert results[1:] == [["ONE", "TWO"], ["OTHER"], ["THREE", "FOUR"]]
+    assert run_batch.calls[1:] == [("en-vi", ["one", "two", "three", "four"]), ("en-de", ["other"])]
+
+
+def test_top_up_respects_the_batch_limits():
+    scheduler, run_batch, blocker = make_scheduler(max_batch_size=3)
+    first = submit(scheduler, "a", NORMAL, "en-vi", "one", "two")
+    second = submit(scheduler, "b", NORMAL, "en-vi", "three", "four")
+    drain(run_batch, blocker, first, second)
+    assert run_batch.order() == [["one", "two"], ["three", "four"]]
+
+
+def test_errors_reach_every_job_in_the_batch():
+    def run_batch(key, texts, batch_ids):
+        raise RuntimeError("model failed")
+
+    scheduler = FairScheduler(run_batch, slots=1, max_batch_size=4)
+    futures = [submit(scheduler, owner, NORMAL, "en-vi", "text") for owner in ("a", "b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(timeout=5)
+
+
+def test_admit_limits_running_jobs_per_owner():
+    scheduler = FairScheduler(GatedBatch(), jobs_per_owner=2)
+    assert scheduler.admit("a") and scheduler.admit("a")
+    assert not scheduler.admit("a")
+    assert scheduler.admit("b")
+    scheduler.release("a")
+    assert scheduler.admit("a")
+    for owner in ("a", "a", "b"):
+        scheduler.release(owner)
+    assert scheduler._active_jobs == {}
+
+
+def test_small_books_move_up_a_tier():
+    assert job_priority("bulk") == BULK
+    assert job_priority("bulk", SMALL_JOB_BYTES - 1) == NORMAL
+    assert job_priority("high", 1) == HIGH
+    assert job_priority("unknown", SMALL_JOB_BYTES) == NORMAL
@@ -0,0 +1,107 @@
+import io
+import time
+
+import pytest
+
+import job_store
+from job_store import DONE, FAILED, QUEUED, RUNNING, JobLease, JobStore, content_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def create(store, unique_id, key="book:en-vi:v1", email="reader@example.com"):
+    return store.create_or_attach(unique_id, key, "bucket", f"{unique_id}.txt", "en", "vi", email)
+
+
+def test_repeat_upload_attaches_to_the_job_in_flight(store):
+    assert create(store, "job-1") == ("job-1", True)
+    assert create(store, "job-2", email="other@example.com") == ("job-1", False)
+    assert sorted(store.recipients("job-1")) == ["other@example.com", "reader@example.com"]
+
+
+def test_failed_job_frees_the_book_for_a_new_upload(store):
+    create(store, "job-1")
+    store.set_state("job-1", FAILED, error="gave up")
+    assert create(store, "job-2") == ("job-2", True)
+    assert store.get("job-1")["state"] == FAILED
+
+
+def test_stale_running_job_expires(store, monkeypatch):
+    create(store, "job-1")
+    assert store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    monkeypatch.setattr(job_store, "JOB_RUNNING_LEASE_SECONDS", 0)
+    time.sleep(0.01)
+    assert create(store, "job-2") == ("job-2", True)
+    job = store.get("job-1")
+    assert job["state"] == FAILED
+    assert job["error"] == "Lease expired"
+
+
+def test_expired_job_does_not_come_back_while_a_newer_one_runs(store, monkeypatch):
+    create(store, "job-1")
+    monkeypatch.setattr(job_store, "JOB_QUEUED_LEASE_SECONDS", 0)
+    time.sleep(0.01)
+    create(store, "job-2")
+    monkeypatch.setattr(job_store, "JOB_QUEUED_LEASE_SECONDS", 3600)
+    # A late redelivery of job-1 neither starts nor goes back to queued
+    assert not store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    store.set_state("job-1", QUEUED, error="retry")
+    assert store.get("job-1")["state"] == FAILED
+    assert store.get("job-2")["state"] == QUEUED
+
+
+def test_done_job_is_not_started_again(store):
+    create(store, "job-1")
+    store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    store.set_state("job-1", DONE, result_key="job-1_translated.txt")
+    assert not store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    assert store.find_done("book:en-vi:v1")["unique_id"] == "job-1"
+
+
+def test_start_adds_jobs_queued_without_the_api(store):
+    assert store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    assert store.get("job-1")["state"] == RUNNING
+
+
+def test_stuck_jobs_are_reported_as_failed(store, monkeypatch):
+    create(store, "job-1")
+    assert store.counts() == {QUEUED: 1}
+    monkeypatch.setattr(job_store, "JOB_QUEUED_LEASE_SECONDS", 0)
+    time.sleep(0.01)
+    assert store.counts() == {FAILED: 1}
+    assert [job["state"] for job in store.list_jobs()] == [FAILED]
+    assert store.get("job-1")["error"] == "Lease expired"
+
+
+def test_lease_keeps_a_waiting_job_running(store, monkeypatch):
+    create(store, "job-1")
+    store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    monkeypatch.setattr(job_store, "JOB_RUNNING_LEASE_SECONDS", 0.2)
+    # No progress is written while the lease is held, for longer than the lease
+    with JobLease(store, "job-1", interval=0.02):
+        for _ in range(20):
+            time.sleep(0.02)
+            assert store.get("job-1")["state"] == RUNNING
+    time.sleep(0.3)
+    assert store.get("job-1")["state"] == FAILED
+
+
+def test_lease_does_not_revive_a_finished_job(store):
+    create(store, "job-1")
+    store.start("job-1", "bucket", "job-1.txt", "en", "vi", "reader@example.com")
+    store.set_state("job-1", DONE, result_key="job-1_translated.txt")
+    updated = store.get("job-1")["updated"]
+    store.renew("job-1")
+    assert store.get("job-1")["updated"] == updated
+
+
+def test_content_key_ignores_line_endings_split_across_reads():
+    unix = b"line one\nline two\n" * 100
+    windows = unix.replace(b"\n", b"\r\n")
+    key = content_key(io.BytesIO(unix), "en", "vi")
+    for chunk_size in (1, 2, 3, 1024 * 1024):
+        assert content_key(io.BytesIO(windows), "en", "vi", chunk_size=chunk_size) == key
+    assert content_key(io.BytesIO(unix + b"\r"), "en", "vi", chunk_size=2) != key
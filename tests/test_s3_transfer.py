@@ -0,0 +1,79 @@
+import pytest
+
+import s3_transfer
+from s3_transfer import LineStream, LocalS3Client, read_text_object, upload_stream
+
+
+@pytest.fixture
+def local_s3(tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_transfer, "S3_LOCAL_DIR", str(tmp_path))
+    monkeypatch.setattr(s3_transfer, "_client", None)
+    return s3_transfer.get_s3_client()
+
+
+def book_lines(count):
+    return [f"Line {i} of the book, ünïcödé included.\n" for i in range(count)]
+
+
+def test_local_client_round_trip(local_s3):
+    assert isinstance(local_s3, LocalS3Client)
+    lines = book_lines(5000)
+    upload_stream(LineStream(lines), "books", "dir/book.txt")
+    assert local_s3.head_object(Bucket="books", Key="dir/book.txt")["ContentLength"] == len("".join(lines).encode("utf-8"))
+    with read_text_object("books", "dir/book.txt") as f:
+        assert f.readlines() == lines
+
+
+def test_local_client_rejects_keys_outside_its_root(local_s3):
+    with pytest.raises(ValueError):
+        local_s3.put_object(Bucket="books", Key="../../escape.txt", Body=b"x")
+
+
+def test_large_downloads_spill_to_disk(local_s3, monkeypatch):
+    monkeypatch.setattr(s3_transfer, "S3_SPOOL_MAX_MB", 1)
+    local_s3.put_object(Bucket="books", Key="small.txt", Body="small")
+    local_s3.put_object(Bucket="books", Key="large.txt", Body="x" * (2 * s3_transfer.MB))
+    with read_text_object("books", "small.txt") as f:
+        assert not f.buffer._rolled
+        assert f.read() == "small"
+    with read_text_object("books", "large.txt") as f:
+        assert f.buffer._rolled
+        assert len(f.read()) == 2 * s3_transfer.MB
+
+
+def test_line_stream_keeps_the_error_of_its_lines(local_s3):
+    def lines():
+        yield "first\n"
+        raise RuntimeError("model failed")
+
+    stream = LineStream(lines())
+    with pytest.raises(RuntimeError):
+        upload_stream(stream, "books", "broken.txt")
+    assert str(stream.error) == "model failed"
+    # The partial object is never published
+    with pytest.raises(FileNotFoundError):
+        local_s3.head_object(Bucket="books", Key="broken.txt")
+
+
+def test_multipart_upload_round_trip(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(s3_transfer, "S3_LOCAL_DIR", "")
+    monkeypatch.setattr(s3_transfer, "AWS_REGION", "us-east-1")
+    monkeypatch.setattr(s3_transfer, "S3_MULTIPART_THRESHOLD_MB", 5)
+    monkeypatch.setattr(s3_transfer, "S3_MULTIPART_CHUNKSIZE_MB", 5)
+    monkeypatch.setattr(s3_transfer, "_client", None)
+    monkeypatch.setattr(s3_transfer, "_transfer_config", None)
+    with moto.mock_aws():
+        client = s3_transfer.get_s3_client()
+        client.create_bucket(Bucket="books-bucket")
+        lines = book_lines(300000)
+        upload_stream(LineStream(lines), "books-bucket", "book.txt")
+        head = client.head_object(Bucket="books-bucket", Key="book.txt")
+        # More than one part was uploaded
+        assert "-" in head["ETag"]
+        with read_text_object("books-bucket", "book.txt") as f:
+            assert f.readlines() == lines
+    monkeypatch.setattr(s3_transfer, "_client", None)
+    monkeypatch.setattr(s3_transfer, "_transfer_config", None)
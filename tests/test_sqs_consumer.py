@@ -0,0 +1,169 @@
+import json
+import time
+import threading
+
+from sqs_consumer import Deferred, InMemorySQS, InvalidMessage, SQSConsumer
+
+QUEUE_URL = "queue"
+
+
+class RecordingSQS(InMemorySQS):
+    def __init__(self):
+        super().__init__()
+        self.visibility_changes = []
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.visibility_changes.append(VisibilityTimeout)
+        super().change_message_visibility(QueueUrl, ReceiptHandle, VisibilityTimeout)
+
+
+def make_consumer(sqs, handler, **kwargs):
+    kwargs.setdefault("wait_seconds", 0)
+    return SQSConsumer(sqs, QUEUE_URL, handler, **kwargs)
+
+
+def send(sqs, body):
+    return sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps(body))["MessageId"]
+
+
+def test_deletes_message_after_handler_returns():
+    sqs = InMemorySQS()
+    handled = []
+    message_id = send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handled.append)
+    assert consumer.poll_once() == 1
+    consumer.stop()
+    assert handled == [{"n": 1}]
+    assert sqs.deleted == [message_id]
+
+
+def test_failed_message_stays_on_queue():
+    sqs = InMemorySQS()
+
+    def handler(body):
+        raise RuntimeError("translation failed")
+
+    send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handler, visibility_timeout=0)
+    consumer.poll_once()
+    consumer.stop()
+    assert sqs.deleted == []
+    assert len(sqs.receive_message(QueueUrl=QUEUE_URL)["Messages"]) == 1
+
+
+def test_heartbeat_keeps_running_message_invisible():
+    sqs = RecordingSQS()
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(body):
+        started.set()
+        release.wait(5)
+
+    message_id = send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handler, visibility_timeout=1, heartbeat_seconds=0.2)
+    consumer.poll_once()
+    assert started.wait(5)
+    # Past the original visibility timeout the message is still hidden
+    time.sleep(1.5)
+    assert sqs.receive_message(QueueUrl=QUEUE_URL) == {}
+    release.set()
+    consumer.stop()
+    assert sqs.visibility_changes and all(v == 1 for v in sqs.visibility_changes)
+    assert sqs.deleted == [message_id]
+
+
+def test_malformed_and_invalid_messages_are_deleted():
+    sqs = InMemorySQS()
+
+    def handler(body):
+        raise InvalidMessage("missing s3_key")
+
+    sqs.send_message(QueueUrl=QUEUE_URL, MessageBody="not json")
+    send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handler)
+    assert consumer.poll_once() == 2
+    consumer.stop()
+    assert len(sqs.deleted) == 2
+    assert sqs.receive_message(QueueUrl=QUEUE_URL) == {}
+
+
+def test_deferred_message_is_handled_again_later():
+    sqs = InMemorySQS()
+    calls = []
+
+    def handler(body):
+        calls.append(body)
+        if len(calls) < 4:
+            raise Deferred("owner is busy", delay_seconds=0)
+
+    original_id = send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handler, max_receives=2)
+    for _ in range(4):
+        consumer.poll_once()
+        time.sleep(0.05)
+    consumer.stop()
+    # Deferred more often than max_receives without being given up
+    assert calls == [{"n": 1}] * 4
+    assert original_id in sqs.deleted
+    assert sqs.receive_message(QueueUrl=QUEUE_URL) == {}
+
+
+def test_deferral_sends_the_message_again_with_a_delay():
+    sqs = InMemorySQS()
+
+    def handler(body):
+        raise Deferred("owner is busy", delay_seconds=1)
+
+    original_id = send(sqs, {"n": 1})
+    consumer = make_consumer(sqs, handler)
+    consumer.poll_once()
+    consumer.stop()
+    assert sqs.deleted == [original_id]
+    assert sqs.receive_message(QueueUrl=QUEUE_URL) == {}
+    time.sleep(1.1)
+    (message,) = sqs.receive_message(QueueUrl=QUEUE_URL)["Messages"]
+    assert json.loads(message["Body"]) == {"n": 1}
+    assert message["Attributes"]["ApproximateReceiveCount"] == "1"
+
+
+def failing_handler(body):
+    raise RuntimeError("translation failed")
+
+
+def test_gives_up_and_deletes_after_max_receives_without_dead_letter_queue():
+    sqs = InMemorySQS()
+    given_up = []
+    send(sqs, {"unique_id": "job-1"})
+    consumer = make_consumer(
+        sqs, failing_handler, visibility_timeout=0, max_receives=3,
+        on_give_up=lambda body, error: given_up.append((body, str(error))),
+    )
+    for _ in range(3):
+        consumer.poll_once()
+        time.sleep(0.05)
+    consumer.stop()
+    assert given_up == [({"unique_id": "job-1"}, "translation failed")]
+    assert len(sqs.deleted) == 1
+
+
+def test_gives_up_on_the_redrive_policy_limit_and_leaves_the_message_to_it():
+    sqs = InMemorySQS(max_receive_count=2)
+    given_up = []
+    message_id = send(sqs, {"unique_id": "job-1"})
+    consumer = make_consumer(
+        sqs, failing_handler, visibility_timeout=0, max_receives=10,
+        on_give_up=lambda body, error: given_up.append(body),
+    )
+    assert consumer.max_receives == 2
+    consumer.poll_once()
+    time.sleep(0.05)
+    assert given_up == []
+    consumer.poll_once()
+    time.sleep(0.05)
+    assert given_up == [{"unique_id": "job-1"}]
+    # SQS, not the consumer, moves it to the dead-letter queue
+    assert consumer.poll_once() == 0
+    consumer.stop()
+    assert sqs.deleted == []
+    assert sqs.dead_letters == [message_id]
@@ -0,0 +1,52 @@
+import time
+
+from metrics import STAGE_SECONDS, observe_generate
+
+
+def _direction(translator):
+    # Metrics label; anything with `model` and `tokenizer` can be passed in
+    return getattr(translator, "direction", "unknown")
+
+
+def encode_batch(translator, texts):
+    tokenizer = translator.tokenizer
+    with STAGE_SECONDS.time(direction=_direction(translator), stage="tokenize"):
+        return [tokenizer.convert_ids_to_tokens(ids) for ids in tokenizer(texts).input_ids]
+
+
+def ids_to_source_tokens(translator, batch_ids):
+    """Turn token ids without special tokens into model input tokens."""
+    tokenizer = translator.tokenizer
+    with STAGE_SECONDS.time(direction=_direction(translator), stage="tokenize"):
+        return [
+            tokenizer.convert_ids_to_tokens(tokenizer.build_inputs_with_special_tokens(list(ids)))
+            for ids in batch_ids
+        ]
+
+
+def decode_batch(translator, hypotheses):
+    tokenizer = translator.tokenizer
+    with STAGE_SECONDS.time(direction=_direction(translator), stage="detokenize"):
+        return [
+            tokenizer.decode(tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True)
+            for tokens in hypotheses
+        ]
+
+
+def translate_tokens(translator, source_tokens):
+    start_time = time.perf_counter()
+    results = translator.model.translate_batch(source_tokens)
+    hypotheses = [result.hypotheses[0] for result in results]
+    observe_generate(
+        _direction(translator),
+        len(source_tokens),
+        sum(len(tokens) for tokens in source_tokens),
+        sum(len(tokens) for tokens in hypotheses),
+        time.perf_counter() - start_time,
+    )
+    return hypotheses
+
+
+def translate_ids_batch(translator, batch_ids):
+    """Translate already tokenized inputs without encoding their text again."""
+    return decode_batch(translator, translate_tokens(translator, ids_to_source_tokens(translator, batch_ids)))
@@ -9,7 +9,8 @@ def translate_book(file_path, source_lang, target_lang, recipient_email):
             '-F', f'file=@{file_path}',
             '-F', f'source_lang={source_lang}',
             '-F', f'target_lang={target_lang}',
-            '-F', f'recipient_email={recipient_email}'
+            '-F', f'recipient_email={recipient_email}',
+            '-F', 'priority=bulk'  # Let interactive uploads go first
         ]
         subprocess.run(curl_command, check=True)
         print(f'Translated: {file_path}')
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from metrics import CACHE_LOOKUPS
+
+TM_MAX_ENTRIES = int(os.getenv("TM_MAX_ENTRIES", "100000"))
+TM_TTL_SECONDS = float(os.getenv("TM_TTL_SECONDS", str(7 * 24 * 3600)))
+# Optional sqlite file shared by main.py and conversion_service.py
+TM_SQLITE_PATH = os.getenv("TM_SQLITE_PATH", "")
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def memory_key(text, source_lang, target_lang, model_id):
+    raw = "\x1f".join([normalize_text(text), source_lang, target_lang, model_id])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SqliteBackend:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translation_memory "
+                "(key TEXT PRIMARY KEY, translation TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key, min_created):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translation FROM translation_memory WHERE key = ? AND created >= ?",
+                (key, min_created),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, translation, created):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translation_memory (key, translation, created) VALUES (?, ?, ?)",
+                (key, translation, created),
+            )
+            self._conn.commit()
+
+
+class TranslationMemory:
+    """Exact-match cache of finished translations with LRU and TTL eviction."""
+
+    def __init__(self, max_entries=TM_MAX_ENTRIES, ttl_seconds=TM_TTL_SECONDS, sqlite_path=TM_SQLITE_PATH):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = SqliteBackend(sqlite_path) if sqlite_path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text, source_lang, target_lang, model_id):
+        key = memory_key(text, source_lang, target_lang, model_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                translation, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(cache="memory", result="hit")
+                    return translation
+                del self._entries[key]
+
+        translation = None
+        if self.backend is not None:
+            translation = self.backend.get(key, now - self.ttl_seconds)
+        with self._lock:
+            if translation is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache="memory", result="miss")
+                return None
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache="memory", result="hit")
+            self._store(key, translation, now)
+        return translation
+
+    def put(self, text, source_lang, target_lang, model_id, translation):
+        key = memory_key(text, source_lang, target_lang, model_id)
+        now = time.time()
+        with self._lock:
+            self._store(key, translation, now)
+        if self.backend is not None:
+            self.backend.put(key, translation, now)
+
+    def _store(self, key, translation, created):
+        # Caller must hold self._lock
+        self._entries[key] = (translation, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }